@@ -0,0 +1,370 @@
+"""Scaling benchmarks for Keeper.
+
+Generates synthetic corpora of .note files and Takeout html exports, then
+times the main view and the editor against them. Every corpus size runs in
+its own process with a throwaway HOME, so Keeper's data directory is never
+touched and the peak RSS of each size is measured separately. The results
+are written as JSON so that runs on different revisions can be compared.
+
+Keeper needs a display. On a machine without one, run the benchmarks under
+a virtual X server, either with --xvfb or with xvfb-run:
+
+    python benchmark.py --sizes 1000 10000 100000 --output results.json
+
+"""
+
+from typing import List
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tkinter as tk
+
+words = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+         'eiusmod tempor incididunt ut labore et dolore magna aliqua').split()
+months = 'Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec'.split()
+html_head = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+             '<html xmlns="http://www.w3.org/1999/xhtml"><head>'
+             '<meta http-equiv="Content-Type" content="text/html; '
+             'charset=UTF-8" /><title>{title}</title></head><body>'
+             '<div class="note DEFAULT"><div class="heading">'
+             '<div class="meta-icons"></div>\n{date}\n</div>\n')
+window_sizes = ('1200x800', '900x700')
+scroll_steps = 50
+
+
+class Corpus:
+    """Generator of synthetic note titles and bodies.
+    
+    The number of words in a body follows a log-normal distribution, which
+    gives mostly short notes and a long tail of long ones, like a real
+    collection. Words are split into lines of up to line_words words.
+    
+    Args:
+        seed (int): Seed of the random number generator.
+        median_words (int): Median number of words in a body.
+        spread (float): Standard deviation of the log of the number of
+                        words. 0 makes every body the same length.
+        line_words (int): Maximum number of words in a line.
+        
+    """
+    
+    def __init__(self, seed:int, median_words:int, spread:float,
+                 line_words:int):
+        """The constructor for Corpus class."""
+        self.random = random.Random(seed)
+        self.median_words = median_words
+        self.spread = spread
+        self.line_words = line_words
+        
+    def get_title(self, index:int) -> str:
+        """Return the title of the note with index, or an empty title."""
+        if self.random.random() < 0.2:
+            return ""
+        return "Note {} {}".format(index, self.random.choice(words))
+        
+    def get_body(self) -> str:
+        """Return a body with a random number of words and lines."""
+        count = int(self.random.lognormvariate(0, self.spread) *
+                    self.median_words) + 1
+        lines = []
+        while count > 0:
+            length = min(count, self.random.randint(1, self.line_words))
+            lines.append(' '.join(self.random.choice(words)
+                                  for word in range(length)))
+            count -= length
+        return '\n'.join(lines)
+        
+    def write_notes(self, directory:str, count:int):
+        """Write count .note files into directory, one minute apart."""
+        os.makedirs(directory, exist_ok=True)
+        start = time.time()
+        for index in range(count):
+            date = time.localtime(start - 60*index)
+            name = "{}-{:02}-{:02}T{:02}_{:02}_{:02}.note".format(*date[0:6])
+            fp = open(os.path.join(directory, name), 'w')
+            fp.write('\n'.join([self.get_title(index), self.get_body()]))
+            fp.close()
+        
+    def write_takeout(self, directory:str, count:int,
+                      json_files:bool=False) -> List[str]:
+        """Write count Takeout html files into directory, return their paths.
+        
+        If json_files is true, each html file gets a json sibling with the
+        same note, as Takeout writes them.
+        """
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for index in range(count):
+            month, day, hour = index % 12, index % 28 + 1, index // 3600 % 12
+            minute, second = index // 60 % 60, index % 60
+            date = "{} {}, 2017, {}:{:02}:{:02} AM".format(
+                   months[month], day, hour + 1, minute, second)
+            title = self.get_title(index)
+            text = self.get_body()
+            body = text.replace('&', '&amp;').replace('<', '&lt;')
+            html = html_head.format(title=title or date, date=date)
+            if title:
+                html += '<div class="title">{}</div>\n'.format(title)
+            html += '<div class="content">{}</div>\n</div></body></html>'.\
+                    format(body.replace('\n', '<br>'))
+            if title:
+                name = "Note {}.html".format(index)
+            else:
+                name = "2017-{:02}-{:02}T{:02}_{:02}_{:02}.000-08_00.html".\
+                       format(month + 1, day, hour + 1, minute, second)
+            path = os.path.join(directory, name)
+            fp = open(path, 'w')
+            fp.write(html)
+            fp.close()
+            paths.append(path)
+            if json_files:
+                seconds = time.mktime((2017, month + 1, day, hour + 1, minute,
+                                       second, 0, 0, -1))
+                fp = open(path[:-4] + 'json', 'w')
+                json.dump({'title': title, 'textContent': text,
+                           'userEditedTimestampUsec': int(seconds * 1000000),
+                           'isTrashed': False, 'isArchived': False}, fp)
+                fp.close()
+        return paths
+        
+        
+def get_stats(times:List[float]) -> dict:
+    """Return the summary of a list of durations in seconds."""
+    return {'runs': len(times), 'min': min(times),
+            'median': statistics.median(times), 'max': max(times)}
+        
+def wait_for(root:tk.Tk, condition, timeout:float=600):
+    """Run the Tk event loop of root until condition() is true."""
+    end = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > end:
+            raise TimeoutError("benchmark step did not finish")
+        root.update()
+        time.sleep(0.001)
+        
+def run_size(args:argparse.Namespace) -> dict:
+    """Run every benchmark against a corpus of args.size notes.
+    
+    This must run in a process whose HOME is a throwaway directory, since
+    importing core sets the data paths.
+    """
+    corpus = Corpus(args.seed, args.median_words, args.spread,
+                    args.line_words)
+    
+    import core
+    corpus.write_notes(core.notes_dir, args.size)
+    html_list = corpus.write_takeout(os.path.join(os.path.expanduser('~'),
+                                                  'takeout'),
+                                     args.import_notes, args.takeout_json)
+    result = {'size': args.size}
+    
+    start = time.perf_counter()
+    import main
+    main.canvas_items = args.canvas_items
+    main.create_window()
+    root = main.root
+    root.geometry(window_sizes[0])
+    root.update()
+    result['window'] = time.perf_counter() - start
+    
+    if args.log_store:
+        core.migrate_notes()
+    start = time.perf_counter()
+    core.note_index.refresh()
+    core.note_index.save()
+    result['index_build'] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    root.main_view = view = main.ScrollableNoteBoxView(root)
+    core.note_index.load()
+    result['index'] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    view.init()
+    root.update()
+    result['init'] = time.perf_counter() - start
+    result['first_paint'] = result['window'] + result['index'] + \
+                            result['init']
+    
+    start = time.perf_counter()
+    wait_for(root, lambda: view.load_job is None)
+    root.update()
+    result['load'] = time.perf_counter() - start
+    
+    times = []
+    for run in range(args.repeat):
+        view.hide_all()
+        view.invalidate_layout()
+        start = time.perf_counter()
+        view.refresh_frames()
+        root.update()
+        times.append(time.perf_counter() - start)
+    result['refresh_frames'] = get_stats(times)
+    
+    times = []
+    for step in range(1, scroll_steps + 1):
+        start = time.perf_counter()
+        view.on_scrollbar('moveto', step / scroll_steps)
+        root.update()
+        times.append(time.perf_counter() - start)
+    view.on_scrollbar('moveto', 0)
+    result['scroll'] = get_stats(times)
+    
+    times = []
+    for run in range(args.repeat):
+        root.geometry(window_sizes[(run + 1) % 2])
+        root.update()
+        start = time.perf_counter()
+        view.apply_resize()
+        wait_for(root, lambda: view.rewrap_job is None)
+        root.update()
+        times.append(time.perf_counter() - start)
+    result['resize'] = get_stats(times)
+    
+    for key, edit in (('close_unchanged', False), ('close_changed', True)):
+        times = []
+        for run in range(args.repeat):
+            notebox = view.box_list[run % len(view.box_list)]
+            view.pack_forget()
+            editor = main.EditText(root, notebox)
+            if edit:
+                editor.text.insert('end', " edited")
+            root.update()
+            start = time.perf_counter()
+            editor.close_frame(None)
+            root.update()
+            times.append(time.perf_counter() - start)
+        result[key] = get_stats(times)
+        
+    if html_list:
+        start = time.perf_counter()
+        job = main.import_notes(html_list, first_run=True)
+        wait_for(root, lambda: not job.pending)
+        root.update()
+        result['import'] = time.perf_counter() - start
+        result['imported'] = job.imported
+        
+    main.on_close()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    result['peak_rss_kb'] = usage.ru_maxrss
+    result['peak_children_rss_kb'] = children.ru_maxrss
+    return result
+    
+def start_xvfb() -> tuple:
+    """Start Xvfb on a free display, return the process and display name."""
+    if not shutil.which('Xvfb'):
+        sys.exit("Xvfb is not installed")
+    for number in range(99, 200):
+        if os.path.exists('/tmp/.X{}-lock'.format(number)):
+            continue
+        display = ':{}'.format(number)
+        server = subprocess.Popen(['Xvfb', display, '-screen', '0',
+                                   '1920x1080x24', '-nolisten', 'tcp'],
+                                  stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+        for attempt in range(50):
+            if os.path.exists('/tmp/.X11-unix/X{}'.format(number)):
+                return server, display
+            if server.poll() is not None:
+                break
+            time.sleep(0.1)
+        server.kill()
+    sys.exit("could not start Xvfb")
+    
+def get_revision() -> str:
+    """Return the git revision of the working tree, if there is one."""
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+        
+def get_args() -> argparse.Namespace:
+    """Parse the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000],
+                        help="numbers of notes to benchmark")
+    parser.add_argument('--import-notes', type=int, default=500,
+                        help="number of Takeout html files to import")
+    parser.add_argument('--takeout-json', action='store_true',
+                        help="write a json file next to each html file")
+    parser.add_argument('--median-words', type=int, default=40,
+                        help="median number of words in a note")
+    parser.add_argument('--spread', type=float, default=1.0,
+                        help="spread of the note lengths, 0 for fixed")
+    parser.add_argument('--line-words', type=int, default=20,
+                        help="maximum number of words in a line")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="runs of each repeatable benchmark")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--canvas-items', action='store_true',
+                        help="draw the notes as canvas items, not labels")
+    parser.add_argument('--log-store', action='store_true',
+                        help="store the notes in a log instead of files")
+    parser.add_argument('--xvfb', action='store_true',
+                        help="run under a new Xvfb server")
+    parser.add_argument('--output', help="write the JSON here, not stdout")
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    return parser.parse_args()
+    
+def main():
+    """Main function."""
+    args = get_args()
+    if args.size is not None:
+        json.dump(run_size(args), sys.stdout)
+        return
+        
+    env = dict(os.environ)
+    server = None
+    if args.xvfb:
+        server, env['DISPLAY'] = start_xvfb()
+        
+    results = []
+    try:
+        for size in args.sizes:
+            home = tempfile.mkdtemp(prefix='keeper-benchmark-')
+            env['HOME'] = home
+            command = [sys.executable, os.path.abspath(__file__)]
+            command.extend(arg for arg in sys.argv[1:] if arg != '--xvfb')
+            command.extend(['--size', str(size)])
+            try:
+                process = subprocess.run(command, env=env, check=True,
+                                         stdout=subprocess.PIPE, text=True)
+            finally:
+                shutil.rmtree(home, ignore_errors=True)
+            results.append(json.loads(process.stdout))
+            print("{} notes done".format(size), file=sys.stderr)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+        
+    report = {'revision': get_revision(),
+              'python': sys.version.split()[0],
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'options': {key: value for key, value in vars(args).items()
+                          if key not in ('size', 'output', 'xvfb')},
+              'results': results}
+    if args.output:
+        fp = open(args.output, 'w')
+        json.dump(report, fp, indent=2)
+        fp.close()
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        
+if __name__ == '__main__':
+    main()
+    
\ No newline at end of file
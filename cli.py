@@ -0,0 +1,304 @@
+"""Command line interface to Keeper's notes.
+
+Notes can be imported, listed, exported, and removed without opening the
+window, for scripts and bulk work. Every command writes one line per note as
+soon as that note is done, and nothing is collected in memory on the way, so
+the output can be piped into other programs and directories of any size can
+be processed:
+
+    python main.py list --search recipe | python main.py rm -
+    
+A note is named by its filename, which is the first column of the output of
+list and import. Export writes notes to a bundle, a single file with one
+note per line as JSON, which import reads back:
+
+    python main.py export -o notes.jsonl.gz
+    python main.py import notes.jsonl.gz
+"""
+
+from typing import Iterator, List
+import argparse
+import collections
+import itertools
+import multiprocessing
+import os
+import sys
+import zipfile
+import core
+
+commands = ('import', 'list', 'export', 'rm')
+import_batch_size = 50
+
+
+def write_line(line:str):
+    """Write a line of output."""
+    sys.stdout.write(line + '\n')
+    
+def write_error(message:str):
+    """Write an error message."""
+    sys.stderr.write("keeper: {}\n".format(message))
+    
+def get_names(args:List[str]) -> Iterator[str]:
+    """Yield the note filenames in args, reading them from stdin for '-'.
+    
+    Only the first tab-separated column of a line read from stdin is used, so
+    that the output of list can be piped in directly.
+    """
+    for arg in args:
+        if arg != '-':
+            yield os.path.basename(arg)
+            continue
+        for line in sys.stdin:
+            name = line.split('\t')[0].strip()
+            if name:
+                yield os.path.basename(name)
+        
+def get_all_names() -> Iterator[str]:
+    """Yield the filename of every note, most recent first."""
+    return iter(sorted((name for name, stamp in core.note_store.scan()),
+                       reverse=True))
+        
+def import_notes(args:argparse.Namespace) -> int:
+    """Import bundles written by export, and Takeout notes."""
+    failed = 0
+    paths = []
+    for path in args.paths:
+        error = get_import_error(path)
+        if error:
+            write_error("{}: {}".format(path, error))
+            failed += 1
+        elif core.is_bundle(path):
+            failed += import_bundle(path)
+        else:
+            paths.append(path)
+    if paths:
+        failed += import_takeout(paths, args.jobs or os.cpu_count() or 1)
+    return 1 if failed else 0
+    
+def get_import_error(path:str) -> str:
+    """Return why path cannot be imported, or None if it can."""
+    if not os.path.exists(path):
+        return "no such file or directory"
+    if os.path.isdir(path) or core.is_bundle(path) or \
+       path[-4:] in ('html', 'json'):
+        return None
+    if path[-4:] == '.zip':
+        return None if zipfile.is_zipfile(path) else "not a zip archive"
+    return "not a bundle, Takeout file or archive, or directory"
+    
+def import_bundle(path:str) -> int:
+    """Save every note in a bundle under its own filename, return the number that failed.
+    
+    A note that already exists under that filename is replaced, unless it
+    has the same title and body, in which case nothing is written. Notes
+    are saved in batches of import_batch_size, which share one sync.
+    """
+    failed = 0
+    batch = {}
+    try:
+        for number, note in enumerate(core.read_bundle(path), 1):
+            if note is None:
+                write_error("{}: line {} is not a note".format(path, number))
+                failed += 1
+                continue
+            name, title, body = note
+            if core.note_index.get_hash(name) == core.hash_note(title, body):
+                continue
+            batch[name] = (title, body)
+            if len(batch) == import_batch_size:
+                save_bundle_batch(batch)
+                batch = {}
+    except (OSError, EOFError, UnicodeDecodeError) as error:
+        # unreadable, or not gzipped or cut off; the notes read so far are kept
+        write_error("{}: {}".format(path, error))
+        failed += 1
+    save_bundle_batch(batch)
+    return failed
+    
+def save_bundle_batch(batch:dict):
+    """Save and index a batch of notes from a bundle, keyed by filename."""
+    stamps = core.note_store.write_batch(batch)
+    for name, (title, body) in batch.items():
+        core.index_note(os.path.join(core.notes_dir, name), title, body,
+                        stamps[name])
+        write_line(name + '\t' + title)
+        
+def import_takeout(paths:List[str], jobs:int) -> int:
+    """Import Takeout html and json files, archives, and directories holding them.
+    
+    The files are parsed and saved in a pool of jobs worker processes, as in
+    the window, but only a few batches are handed to the pool at a time, so
+    the sources are read as the import goes rather than all up front. Notes
+    keep the date they have in Takeout, and notes that are already stored
+    are skipped. A changed note that was imported before replaces the note
+    it was saved as. Returns the number that failed.
+    """
+    core.import_index.load()
+    sources = core.iter_import_sources(paths)
+    batches = iter(lambda: list(itertools.islice(sources, import_batch_size)),
+                   [])
+    pool = multiprocessing.get_context('spawn').Pool(
+           jobs, initializer=core.init_worker,
+           initargs=(core.trace.path, core.trace.start_time,
+                     core.note_index.get_hashes(),
+                     core.import_index.names))
+    pending = collections.deque()
+    failed = 0
+    try:
+        for batch in batches:
+            pending.append((batch, pool.apply_async(core.import_batch,
+                                                    (batch, True))))
+            if len(pending) > 2 * jobs:
+                failed += finish_import_batch(*pending.popleft())
+        while pending:
+            failed += finish_import_batch(*pending.popleft())
+    finally:
+        pool.terminate()
+        pool.join()
+    return failed
+    
+def finish_import_batch(batch:List[tuple],
+                        result:'multiprocessing.pool.AsyncResult') -> int:
+    """Wait for an import batch, index its notes, return the number that failed."""
+    try:
+        results, recorded = result.get()
+    except Exception:
+        results, recorded = [None] * len(batch), ([], {})
+    core.note_store.refresh()
+    core.trace.merge(*recorded)
+    failed = 0
+    for (archive, name), note in zip(batch, results):
+        if note is None:
+            write_error("could not import {}".format(
+                        name if archive is None else archive + ':' + name))
+            failed += 1
+        elif note:
+            core.import_index.add(name, note[0])
+            core.index_note(*note)
+            write_line(os.path.basename(note[0]) + '\t' + note[1])
+    sys.stdout.flush()
+    return failed
+    
+def list_notes(args:argparse.Namespace) -> int:
+    """Write the filename and title of every note, most recent first."""
+    matches = None
+    if args.search:
+        matches = core.search_index.search(' '.join(args.search) + ' ')
+    for name in sorted(core.note_index.entries, reverse=True):
+        if matches is None or name in matches:
+            write_line(name + '\t' + core.note_index.entries[name]['title'])
+    return 0
+    
+def export_notes(args:argparse.Namespace) -> int:
+    """Write every note, or the named notes, to a bundle.
+    
+    The bundle goes to stdout unless an output file is given. It is written
+    next to that file first and moved over it once complete, and the
+    filename of each note is written to stdout as it is added.
+    """
+    if args.output is None:
+        fp = sys.stdout
+    else:
+        temp_path = args.output + '.tmp'
+        fp = core.open_bundle(temp_path, 'w', args.output.endswith('.gz'))
+    status = 0
+    try:
+        for name in get_names(args.names) if args.names else get_all_names():
+            if core.note_store.stat(name) is None:
+                write_error("no note named {}".format(name))
+                status = 1
+                continue
+            fp.write(core.get_bundle_line(name))
+            if fp is not sys.stdout:
+                write_line(name)
+    finally:
+        if fp is not sys.stdout:
+            fp.close()
+    if fp is not sys.stdout:
+        os.replace(temp_path, args.output)
+    return status
+    
+def remove_notes(args:argparse.Namespace) -> int:
+    """Delete the named notes, write the filename of each one deleted.
+    
+    The indexes are not loaded for this; they drop the notes the next time
+    they are refreshed.
+    """
+    status = 0
+    for name in get_names(args.names):
+        if core.note_store.stat(name) is None:
+            write_error("no note named {}".format(name))
+            status = 1
+            continue
+        core.note_store.delete(name)
+        write_line(name)
+    return status
+    
+def get_args(argv:List[str]) -> argparse.Namespace:
+    """Parse the command line."""
+    parser = argparse.ArgumentParser(prog='keeper',
+                                     description=__doc__.split('\n')[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    command = subparsers.add_parser('import',
+                                    help="import bundles or Takeout notes")
+    command.add_argument('paths', nargs='+',
+                         help="bundles (.jsonl or .jsonl.gz), Takeout html or "
+                              "json files, Takeout archives, or directories")
+    command.add_argument('-j', '--jobs', type=int, default=0,
+                         help="worker processes, default one per CPU")
+    command.set_defaults(func=import_notes, indexed=True)
+    
+    command = subparsers.add_parser('list', help="list notes")
+    command.add_argument('-s', '--search', nargs='+', metavar='WORD',
+                         help="only list notes containing every word")
+    command.set_defaults(func=list_notes, indexed=True)
+    
+    command = subparsers.add_parser('export', help="write notes to a bundle")
+    command.add_argument('-o', '--output', metavar='FILE',
+                         help="write the bundle to FILE instead of stdout, "
+                              "gzipped if FILE ends with .gz")
+    command.add_argument('names', nargs='*',
+                         help="notes to export, '-' to read them from stdin, "
+                              "default all")
+    command.set_defaults(func=export_notes, indexed=False)
+    
+    command = subparsers.add_parser('rm', help="delete notes")
+    command.add_argument('names', nargs='+',
+                         help="notes to delete, '-' to read them from stdin")
+    command.set_defaults(func=remove_notes, indexed=False)
+    return parser.parse_args(argv)
+    
+def main(argv:List[str]=None) -> int:
+    """Run a command, return the exit status.
+    
+    The note index holds the title and preview of every note, so it is only
+    loaded for the commands that need them: list, and import, which skips
+    notes that are stored already, so those grow with the number of notes.
+    Export and rm work from note_store alone, and keep at most the names of
+    the notes.
+    """
+    args = get_args(argv)
+    core.check_for_directory()
+    if args.indexed:
+        core.note_index.load()
+        core.note_index.refresh()
+    try:
+        return args.func(args)
+    except BrokenPipeError:
+        # the reader went away, as with head; stop without a traceback
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        return 1
+    finally:
+        core.save_queue.drain()
+        core.note_store.close()
+        core.note_index.save()
+        core.search_index.save()
+        core.import_index.save()
+        core.trace.save()
+        
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
+    
\ No newline at end of file
@@ -0,0 +1,1895 @@
+from typing import Iterator, List
+import bisect
+import contextlib
+import ctypes
+import functools
+import gzip
+import hashlib
+import html.parser
+import io
+import json
+import os
+import re
+import struct
+import threading
+import time
+import zipfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    
+main_dir = os.path.expanduser('~/.local/share/keeper')
+notes_dir = os.path.join(main_dir, 'notes')
+index_path = os.path.join(main_dir, 'index.json')
+search_path = os.path.join(main_dir, 'search.json')
+imports_path = os.path.join(main_dir, 'imports.json')
+trace_path = os.path.join(main_dir, 'trace.json')
+log_path = os.path.join(main_dir, 'notes.log')
+layout_dir = os.path.join(main_dir, 'layout')
+log_chunk_size = 1 << 20
+log_compact_size = 1 << 20
+preview_length = 1024
+min_prefix_length = 2
+import_chunk_size = 1 << 16
+hash_chunk_size = 1 << 16
+bundle_compress_level = 6
+save_delay = 0.25
+open_archives = {}
+known_hashes = set()
+
+word_regex = re.compile('\w+')
+date_regex = re.compile('[JFMASOND][aepuco][nbrylgptvc] \d\d?, \d\d\d\d, \d[012]?:\d\d:\d\d [AP]M')
+
+
+class Trace:
+    """Opt-in recorder of timed spans and counters on the hot paths.
+    
+    Spans time calls such as reading notes, laying out the columns, and
+    parsing imported html. Counters add up font measurements, widgets created
+    and destroyed, and bytes read and written. Nothing is recorded until
+    tracing is started, either with the --trace flag or by setting the
+    KEEPER_TRACE environment variable to the path of the trace file. The
+    trace is saved on close in the Chrome trace event format, which can be
+    opened in chrome://tracing or Perfetto.
+    
+    With a GUI, all the work done on its thread from the first span until it
+    is idle again is one frame, and a summary of the costs of the last frame
+    is kept for display.
+    
+    Args:
+        path (str, optional): Where to save the trace. Tracing is started if
+                              set.
+        
+    Attributes:
+        enabled (bool): Whether spans and counters are being recorded.
+        path (str): Where the trace is saved.
+        pid (int): Id of the process that owns the window.
+        start_time (float): perf_counter time that timestamps count from.
+        events (list): Trace events recorded so far.
+        counters (dict): Running total of each counter.
+        local (obj): Span nesting depth of each thread.
+        frame_spans (list): (name, seconds, depth) of each span of the
+                            current frame.
+        frame_counters (dict): Counters at the start of the current frame.
+        frame_pending (bool): Whether the end of the frame is scheduled.
+        last_frame (str): Summary of the last frame.
+        after_idle (func): Schedules a function to run once the GUI is idle,
+                           None without a GUI.
+        summary (obj): Label that shows last_frame, or None when hidden.
+        
+    """
+    
+    def __init__(self, path:str=None):
+        """The constructor for Trace class."""
+        self.enabled = False
+        self.path = None
+        self.pid = os.getpid()
+        self.start_time = time.perf_counter()
+        self.events = []
+        self.counters = {}
+        self.local = threading.local()
+        self.frame_spans = []
+        self.frame_counters = {}
+        self.frame_pending = False
+        self.last_frame = "No frames yet"
+        self.after_idle = None
+        self.summary = None
+        if path:
+            self.start(path)
+        
+    def start(self, path:str):
+        """Start recording, to be saved at path."""
+        self.path = path
+        self.enabled = True
+        
+    def timed(self, func):
+        """Decorator that records every call of func as a span."""
+        name = func.__qualname__
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            with self.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+        
+    @contextlib.contextmanager
+    def span(self, name:str):
+        """Record the time spent in the with block as a span called name."""
+        if not self.enabled:
+            yield
+            return
+        depth = getattr(self.local, 'depth', 0)
+        self.local.depth = depth + 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.local.depth = depth
+            self.add_span(name, start, end, depth)
+        
+    def add_span(self, name:str, start:float, end:float, depth:int):
+        """Add a finished span to the trace and to the current frame."""
+        self.events.append({'name': name, 'ph': 'X', 'pid': os.getpid(),
+                            'tid': threading.get_ident(),
+                            'ts': (start - self.start_time) * 1e6,
+                            'dur': (end - start) * 1e6})
+        if self.after_idle is None or \
+           threading.current_thread() is not threading.main_thread():
+            return
+        self.frame_spans.append((name, end - start, depth))
+        if not self.frame_pending:
+            self.frame_pending = True
+            self.after_idle(self.end_frame)
+        
+    def count(self, name:str, value:int=1):
+        """Add value to the counter called name."""
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+        
+    def end_frame(self):
+        """Summarize the frame that just ended and start a new one."""
+        self.frame_pending = False
+        self.events.append({'name': 'counters', 'ph': 'C', 'pid': self.pid,
+                            'ts': (time.perf_counter() - self.start_time)*1e6,
+                            'args': dict(self.counters)})
+            
+        total = sum(seconds for name, seconds, depth in self.frame_spans
+                    if not depth)
+        times = {}
+        for name, seconds, depth in self.frame_spans:
+            times[name] = times.get(name, 0) + seconds
+        lines = ["Last frame: {:.1f} ms".format(total * 1000)]
+        for name in sorted(times, key=times.get, reverse=True)[:5]:
+            lines.append("{}: {:.1f} ms".format(name, times[name] * 1000))
+        for name, value in sorted(self.counters.items()):
+            if value != self.frame_counters.get(name, 0):
+                lines.append("{}: {}".format(
+                             name, value - self.frame_counters.get(name, 0)))
+        self.last_frame = '\n'.join(lines)
+        if self.summary:
+            self.summary.config(text=self.last_frame)
+            
+        self.frame_spans = []
+        self.frame_counters = dict(self.counters)
+        
+    def clear(self):
+        """Drop everything recorded so far."""
+        self.events = []
+        self.counters = {}
+        
+    def take(self) -> tuple:
+        """Return the events and counters recorded so far and clear them."""
+        recorded = (self.events, self.counters)
+        self.clear()
+        return recorded
+        
+    def merge(self, events:list, counters:dict):
+        """Add the events and counters that a worker process recorded."""
+        self.events.extend(events)
+        for name, value in counters.items():
+            self.count(name, value)
+        
+    def save(self):
+        """Write the trace to path, if tracing."""
+        if not self.enabled:
+            return
+        names = [{'name': 'process_name', 'ph': 'M', 'pid': pid,
+                  'args': {'name': "Keeper" if pid == self.pid
+                                   else "Import worker"}}
+                 for pid in {event['pid'] for event in self.events}]
+        fp = open(self.path, 'w')
+        json.dump({'traceEvents': names + self.events,
+                   'displayTimeUnit': 'ms'}, fp)
+        fp.close()
+        
+        
+trace = Trace(os.environ.get('KEEPER_TRACE'))
+
+
+class Note:
+    """A saved note: its title, date, and a preview of its body text.
+    
+    There are three components to each note: title, date created, and body
+    text.
+    Title (optional): This is the first line of the saved note file. If there
+                      is no text, then the first line is blank.
+    Date: This comes from the filename of the saved note file. If a note is
+          imported from Google Keep, then it retains the original date. If a
+          note is changed, then it is given a new date and saved with that
+          new date. Modification date is more important than creation date.
+          This means that the most recently modified notes will always
+          appear first.
+    Body Text: The actual note. Lines are stored with newlines in the saved
+               file but are stripped of newlines when imported.
+        
+    Only the first preview_length characters of the body are kept, which is
+    all that a notebox can show, so a note takes the same memory however long
+    its body is. The full body is read from note_store when it is needed, by
+    read_body. Notes have slots rather than a __dict__ since there is one per
+    saved note. Saves and deletes are handed to save_queue, which writes them
+    to note_store in the background.
+    
+    Attributes:
+        path (str): Absolute path to the saved note's location on disk.
+        title (str): Title of the note.
+        preview (str): First preview_length characters of the body.
+        size (int): Size in bytes of the whole body, encoded as UTF-8.
+        
+    """
+    
+    __slots__ = ('path', 'title', 'preview', 'size')
+    
+    def __init__(self):
+        """The constructor for Note class."""
+        self.path = None
+        self.title = ""
+        self.preview = ""
+        self.size = 0
+        
+    def get_name(self) -> str:
+        """Return the filename of the saved note, or None if it is not saved."""
+        return self.path and os.path.basename(self.path)
+        
+    def get_preview_lines(self) -> List[str]:
+        """Return the lines of the preview."""
+        return self.preview.split('\n')
+        
+    def read_preview(self, path:str):
+        """Set the note's path, title, and preview from the index.
+        
+        A note that is not indexed yet has its entry read from note_store,
+        without adding it to the index.
+        """
+        entry = note_index.get_entry(path)
+        if entry is None:
+            name = os.path.basename(path)
+            entry = note_index.read_entry(name, note_store.stat(name))
+        self.path = path
+        self.title = entry['title']
+        self.preview = entry['preview']
+        self.size = entry['size']
+        
+    @trace.timed
+    def read_body(self) -> str:
+        """Read the full body of the saved note and return it."""
+        if not self.path:
+            return ""
+        title, body = save_queue.read(self.get_name())
+        return '\n'.join(format_lines(split_body(body)))
+        
+    def set_body(self, body:str):
+        """Set the note's preview and size from a new body."""
+        self.preview = body[:preview_length]
+        self.size = len(body.encode('utf-8'))
+        
+    @trace.timed
+    def delete_note(self):
+        """Delete the saved note from disk and from the indexes."""
+        if self.path:
+            save_queue.delete(self.get_name())
+            unindex_note(self.path)
+        
+    @trace.timed
+    def save_note(self, filename:str, body:str):
+        """Save the note with body to disk under filename.
+        
+        The note is indexed right away without a stamp, which it is given
+        once save_queue has written it.
+        """
+        self.path = os.path.join(notes_dir, filename)
+        save_queue.write(filename, self.title, body)
+        index_note(self.path, self.title, body, None)
+        self.set_body(body)
+        
+        
+class FileStore:
+    """Note storage with one file per note in notes_dir.
+    
+    FileStore and LogStore share the same methods, and everything that
+    reads or writes notes goes through the note_store they are assigned to.
+    Notes are identified by their filename, and every saved version of a
+    note has a stamp: a pair of numbers that changes whenever the note is
+    written. Here the stamp is the file's modification time in nanoseconds
+    and its size.
+    
+    Args:
+        directory (str): Absolute path to the folder of note files.
+        
+    Attributes:
+        directory (str): Absolute path to the folder of note files.
+        
+    """
+    
+    def __init__(self, directory:str):
+        """The constructor for FileStore class."""
+        self.directory = directory
+        
+    def scan(self) -> Iterator[tuple]:
+        """Yield (name, stamp) for every stored note."""
+        try:
+            dir_entries = os.scandir(self.directory)
+        except FileNotFoundError:
+            return
+        for dir_entry in dir_entries:
+            if dir_entry.name.endswith('.note'):
+                stat = dir_entry.stat()
+                yield dir_entry.name, [stat.st_mtime_ns, stat.st_size]
+        
+    def stat(self, name:str) -> list:
+        """Return the stamp of a note, or None if there is no such note."""
+        try:
+            stat = os.stat(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            return None
+        return [stat.st_mtime_ns, stat.st_size]
+        
+    def read(self, name:str) -> tuple:
+        """Return the title and body of a note."""
+        fp = open(os.path.join(self.directory, name), 'r')
+        title = fp.readline()[:-1]
+        body = fp.read()
+        if trace.enabled:
+            trace.count('bytes_read', fp.tell())
+        fp.close()
+        return title, body
+        
+    def read_preview(self, name:str, length:int) -> tuple:
+        """Return the title, the first length characters of the body, the body's size, and the note's hash.
+        
+        The rest of the body is hashed a chunk at a time rather than kept.
+        """
+        fp = open(os.path.join(self.directory, name), 'r')
+        title = fp.readline()[:-1]
+        preview = fp.read(length)
+        note_hash = hashlib.blake2b('\n'.join([title, preview]).encode('utf-8'),
+                                    digest_size=16)
+        for chunk in iter(lambda: fp.read(hash_chunk_size), ''):
+            note_hash.update(chunk.encode('utf-8'))
+        if trace.enabled:
+            trace.count('bytes_read', fp.tell())
+        size = os.fstat(fp.fileno()).st_size - len(title.encode('utf-8')) - 1
+        fp.close()
+        return title, preview, max(size, 0), note_hash.hexdigest()
+        
+    def write(self, name:str, title:str, body:str) -> list:
+        """Save a note and return its stamp."""
+        return self.write_batch({name: (title, body)})[name]
+        
+    @trace.timed
+    def write_batch(self, changes:dict, replace:bool=True) -> dict:
+        """Save and delete notes together, return the stamp of each note saved.
+        
+        changes maps a note's name to its (title, body), or to None to delete
+        it. Each note is written to a temporary file first. The files are all
+        synced, then each is moved over its note with os.replace, so a crash
+        leaves either the old or the new version of a note and never part of
+        one. Deletes come last, so a note that was renamed is never missing,
+        and the directory is synced once at the end.
+        
+        If replace is not set, a note is only saved if no note with its name
+        is stored, which is checked as it is moved into place, and the notes
+        that were not saved are left out of the stamps.
+        """
+        if not changes:
+            return {}
+        files = []
+        stamps = {}
+        try:
+            for name, note in changes.items():
+                if note is not None:
+                    path = os.path.join(self.directory, name)
+                    fp = open("{}.{}.tmp".format(path, os.getpid()), 'w')
+                    files.append((fp, path))
+                    fp.write('\n'.join(note))
+            for fp, path in files:
+                fp.flush()
+                os.fsync(fp.fileno())
+                fp.close()
+            for fp, path in files:
+                if replace:
+                    os.replace(fp.name, path)
+                else:
+                    try:
+                        # unlike os.replace, a link fails if the note exists
+                        os.link(fp.name, path)
+                    except FileExistsError:
+                        continue
+                    finally:
+                        os.remove(fp.name)
+                stat = os.stat(path)
+                trace.count('bytes_written', stat.st_size)
+                stamps[os.path.basename(path)] = [stat.st_mtime_ns,
+                                                  stat.st_size]
+        except BaseException:
+            # leave no temporary files behind
+            for fp, path in files:
+                with contextlib.suppress(OSError):
+                    fp.close()
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(fp.name)
+            raise
+        for name, note in changes.items():
+            if note is None:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(self.directory, name))
+        sync_directory(self.directory)
+        return stamps
+        
+    def delete(self, name:str):
+        """Delete a note."""
+        os.remove(os.path.join(self.directory, name))
+        
+    def refresh(self):
+        """Pick up notes written by other processes. Files need nothing."""
+        
+    def close(self):
+        """Finish writing to storage. Files need nothing."""
+        
+        
+class LogStore:
+    """Note storage in a single append-only log file.
+    
+    Directories with many thousands of tiny files are slow to list, back up,
+    and sync on some filesystems. This store keeps every note in one log
+    instead. Each save appends a record with the note's name, title, body,
+    and write time, and each delete appends a record marking the note
+    deleted. An offset index saved next to the log maps each note to the
+    offset and length of its latest record, so a read is a single pread.
+    
+    Records appended after the offset index was saved, by the import workers
+    or before a crash, are found again by scanning the log from the end of
+    what the index covers. Once more than half of the log is dead records,
+    close compacts it by copying the live records to a new log.
+    
+    A note's stamp is its write time in nanoseconds and the length of its
+    record, both of which survive compaction. The offsets are guarded by a
+    lock, since save_queue writes from its own thread.
+    
+    Import workers, the command line, and the window may all have the log
+    open at once. Appending, cutting off an incomplete record, and
+    compacting are done while holding an flock on a lock file next to the
+    log, so none of them happens while another process is halfway through
+    a write.
+    
+    Args:
+        path (str): Absolute path to the log file.
+        
+    Attributes:
+        path (str): Absolute path to the log file.
+        index_path (str): Absolute path to the offset index file.
+        lock_path (str): Absolute path to the file that is locked while the
+                         log is written.
+        offsets (dict): [offset, length, time] of each note's latest record,
+                        keyed by name.
+        size (int): Number of bytes of the log covered by offsets.
+        dead (int): Number of bytes of the log taken by replaced records and
+                    delete records.
+        fd (int): File descriptor the log is read through, or None.
+        touched (set): Names of the notes whose records were read since
+                       take_touched was last called, or None if the log was
+                       replaced and every note may have changed.
+        lock (obj): Lock held while offsets and fd are read or updated.
+        
+    """
+    
+    version = 1
+    
+    def __init__(self, path:str):
+        """The constructor for LogStore class."""
+        self.path = path
+        self.index_path = os.path.splitext(path)[0] + '.idx'
+        self.lock_path = path + '.lock'
+        self.offsets = {}
+        self.size = 0
+        self.dead = 0
+        self.fd = None
+        self.touched = set()
+        self.lock = threading.RLock()
+        self.load()
+        
+    def load(self):
+        """Read the offset index and catch up with the end of the log."""
+        try:
+            fp = open(self.index_path, 'r')
+            data = json.load(fp)
+            fp.close()
+        except (OSError, ValueError):
+            data = {}
+        if data.get('version') == self.version:
+            self.offsets = data['notes']
+            self.size = data['size']
+            self.dead = data['dead']
+        if self.refresh():
+            with self.lock_log():
+                # a record still incomplete under the lock was cut off by a crash
+                if self.refresh():
+                    os.truncate(self.path, self.size)
+        self.touched = set()
+        
+    def save(self):
+        """Write the offset index to disk."""
+        temp_path = self.index_path + '.tmp'
+        fp = open(temp_path, 'w')
+        with self.lock:
+            json.dump({'version': self.version, 'size': self.size,
+                       'dead': self.dead, 'notes': self.offsets}, fp,
+                      separators=(',', ':'))
+        fp.close()
+        os.replace(temp_path, self.index_path)
+        
+    @contextlib.contextmanager
+    def lock_log(self):
+        """Hold the lock on the log that every process writing to it takes.
+        
+        Nothing is locked on systems without fcntl.
+        """
+        fd = os.open(self.lock_path, os.O_WRONLY | os.O_CREAT, 0o600)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            # closing the file releases the lock
+            os.close(fd)
+        
+    def open_log(self):
+        """Open the log for reading, creating it if it does not exist."""
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_RDONLY | os.O_CREAT, 0o600)
+        
+    @trace.timed
+    def refresh(self) -> bool:
+        """Read the records appended to the log since offsets was last updated.
+        
+        Returns whether the log ends in an incomplete record. That is either
+        a record being written by another process or one that was cut off by
+        a crash. A log that was replaced, such as by another process
+        compacting it, is read from the start. Lines that are not records
+        are counted as dead and skipped.
+        """
+        with self.lock:
+            self.open_log()
+            replaced = os.fstat(self.fd).st_ino != os.stat(self.path).st_ino
+            if replaced:
+                os.close(self.fd)
+                self.fd = None
+                self.open_log()
+            log_size = os.fstat(self.fd).st_size
+            if replaced or log_size < self.size:
+                self.offsets = {}
+                self.size = 0
+                self.dead = 0
+                self.touched = None
+            offset = self.size
+            tail = b''
+            while offset + len(tail) < log_size:
+                chunk = os.pread(self.fd, log_chunk_size, offset + len(tail))
+                if not chunk:
+                    break
+                trace.count('bytes_read', len(chunk))
+                lines = (tail + chunk).split(b'\n')
+                tail = lines.pop()
+                for line in lines:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        self.dead += len(line) + 1
+                    else:
+                        self.apply_record(offset, len(line) + 1, record)
+                    offset += len(line) + 1
+            self.size = offset
+            return bool(tail)
+        
+    def apply_record(self, offset:int, length:int, record:dict):
+        """Update offsets with a record read from the log."""
+        old = self.offsets.pop(record['name'], None)
+        if old is not None:
+            self.dead += old[1]
+        if self.touched is not None:
+            self.touched.add(record['name'])
+        if record.get('deleted'):
+            self.dead += length
+        else:
+            self.offsets[record['name']] = [offset, length, record['time']]
+        
+    def append(self, records:List[dict], sync:bool=False) -> List[int]:
+        """Append records to the log in a single write, return their lengths.
+        
+        The caller holds lock_log. The log is synced to disk before returning
+        if sync is set.
+        """
+        lines = [json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n'
+                 for record in records]
+        data = b''.join(lines)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, data)
+            if sync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        trace.count('bytes_written', len(data))
+        return [len(line) for line in lines]
+        
+    def scan(self) -> Iterator[tuple]:
+        """Yield (name, stamp) for every stored note."""
+        with self.lock:
+            self.refresh()
+            stamps = [(name, [write_time, length]) for name, (offset, length,
+                      write_time) in self.offsets.items()]
+        yield from stamps
+        
+    def stat(self, name:str) -> list:
+        """Return the stamp of a note, or None if there is no such note."""
+        with self.lock:
+            if name not in self.offsets:
+                return None
+            offset, length, write_time = self.offsets[name]
+        return [write_time, length]
+        
+    def take_touched(self) -> set:
+        """Return touched and start collecting names again."""
+        with self.lock:
+            touched = self.touched
+            self.touched = set()
+        return touched
+        
+    def read_record(self, name:str) -> dict:
+        """Return the latest record of a note."""
+        with self.lock:
+            self.open_log()
+            offset, length, write_time = self.offsets[name]
+            data = os.pread(self.fd, length, offset)
+        trace.count('bytes_read', length)
+        return json.loads(data)
+        
+    def read(self, name:str) -> tuple:
+        """Return the title and body of a note."""
+        record = self.read_record(name)
+        return record['title'], record['body']
+        
+    def read_preview(self, name:str, length:int) -> tuple:
+        """Return the title, the first length characters of the body, the body's size, and the note's hash."""
+        record = self.read_record(name)
+        return record['title'], record['body'][:length], \
+               len(record['body'].encode('utf-8')), \
+               hash_note(record['title'], record['body'])
+        
+    def write(self, name:str, title:str, body:str) -> list:
+        """Save a note and return its stamp."""
+        return self.write_batch({name: (title, body)})[name]
+        
+    @trace.timed
+    def write_batch(self, changes:dict, replace:bool=True) -> dict:
+        """Save and delete notes together, return the stamp of each note saved.
+        
+        changes maps a note's name to its (title, body), or to None to delete
+        it. All the records are appended in one write and synced once, with
+        the deletes last. If replace is not set, notes whose names are stored
+        already are left out, of both the log and the stamps.
+        """
+        if not changes:
+            return {}
+        with self.lock_log():
+            if not replace:
+                self.refresh()
+                changes = {name: note for name, note in changes.items()
+                           if note is None or name not in self.offsets}
+            write_time = time.time_ns()
+            saved = [name for name, note in changes.items()
+                     if note is not None]
+            records = [{'name': name, 'time': write_time,
+                        'title': changes[name][0], 'body': changes[name][1]}
+                       for name in saved]
+            records += [{'name': name, 'deleted': True}
+                        for name, note in changes.items() if note is None]
+            lengths = self.append(records, sync=True)
+        self.refresh()
+        return {name: [write_time, length]
+                for name, length in zip(saved, lengths)}
+        
+    def delete(self, name:str):
+        """Delete a note."""
+        with self.lock_log():
+            self.append([{'name': name, 'deleted': True}])
+        self.refresh()
+        
+    def close(self):
+        """Compact the log if it is mostly dead records, save the offset index."""
+        self.refresh()
+        if self.size > log_compact_size and self.dead * 2 > self.size:
+            with self.lock_log(), self.lock:
+                # catch up with the records other processes appended first
+                self.refresh()
+                self.compact()
+        self.save()
+        
+    @trace.timed
+    def compact(self):
+        """Rewrite the log with only the latest record of each live note.
+        
+        The caller holds lock_log, so that nothing is appended to the old log
+        once it has been copied.
+        """
+        temp_path = self.path + '.tmp'
+        fp = open(temp_path, 'wb')
+        offsets = {}
+        for name, (offset, length, write_time) in \
+                sorted(self.offsets.items(), key=lambda item: item[1][0]):
+            offsets[name] = [fp.tell(), length, write_time]
+            fp.write(os.pread(self.fd, length, offset))
+        fp.flush()
+        os.fsync(fp.fileno())
+        fp.close()
+        os.replace(temp_path, self.path)
+        os.close(self.fd)
+        self.fd = None
+        self.offsets = offsets
+        self.size = sum(length for offset, length, write_time
+                        in offsets.values())
+        self.dead = 0
+        trace.count('bytes_read', self.size)
+        trace.count('bytes_written', self.size)
+        
+        
+note_store = LogStore(log_path) if os.path.exists(log_path) else \
+             FileStore(notes_dir)
+        
+        
+class NoteIndex:
+    """On-disk index of the title and preview of every saved note.
+    
+    Reading every note in full at startup costs one file open per note. The
+    index keeps what the main view needs to draw a note (its title and the
+    first preview_length characters of its body) in a single file, along
+    with the stamp the note had when it was indexed. On refresh, note_store
+    is scanned once and only the notes whose stamps no longer match their
+    entry are read again.
+    
+    Entries are keyed by the note's filename. Each entry is a dict with
+    'stamp', 'title', 'preview', 'size', and 'hash' keys, the last being the
+    note's content hash. The hash is recorded whenever a note is indexed, so
+    that the hashes of all notes can be had without reading any of them.
+    
+    Args:
+        path (str): Absolute path to the index file.
+        
+    Attributes:
+        path (str): Absolute path to the index file.
+        entries (dict): Index entries, keyed by filename.
+        changed (bool): Whether entries differ from the index file on disk.
+        
+    """
+    
+    version = 4
+    
+    def __init__(self, path:str):
+        """The constructor for NoteIndex class."""
+        self.path = path
+        self.entries = {}
+        self.changed = False
+        
+    @trace.timed
+    def load(self):
+        """Read the index file from disk, start empty if it is missing or stale."""
+        try:
+            fp = open(self.path, 'r')
+            data = json.load(fp)
+            fp.close()
+        except (OSError, ValueError):
+            data = {}
+        if data.get('version') == self.version:
+            self.entries = data['notes']
+        else:
+            self.entries = {}
+            self.changed = True
+        
+    @trace.timed
+    def save(self):
+        """Write the index file to disk if any entry changed since the last save."""
+        if not self.changed:
+            return
+        temp_path = self.path + '.tmp'
+        fp = open(temp_path, 'w')
+        json.dump({'version': self.version, 'notes': self.entries}, fp,
+                  separators=(',', ':'))
+        fp.close()
+        os.replace(temp_path, self.path)
+        self.changed = False
+        
+    @trace.timed
+    def refresh(self, names:set=None) -> tuple:
+        """Reindex new or modified notes, drop deleted ones.
+        
+        All of note_store is scanned, unless names is given, in which case
+        only the notes with those names are checked. Notes in save_queue are
+        left alone until they are written. Returns the set of names that
+        were reindexed and the set of names that were dropped.
+        """
+        if names is None:
+            stamps = dict(note_store.scan())
+            names = stamps.keys() | self.entries.keys()
+        else:
+            stamps = {name: note_store.stat(name) for name in names}
+        queued = save_queue.get_names()
+        reindexed = set()
+        dropped = set()
+        for name in names:
+            stamp = stamps.get(name)
+            entry = self.entries.get(name)
+            if name in queued:
+                continue
+            if entry is not None and entry['stamp'] is None and stamp:
+                # written by save_queue, which has not handed back the stamp
+                entry['stamp'] = stamp
+                self.changed = True
+            elif stamp is None:
+                if entry is not None:
+                    del self.entries[name]
+                    dropped.add(name)
+            elif entry is None or entry['stamp'] != stamp:
+                self.entries[name] = self.read_entry(name, stamp)
+                reindexed.add(name)
+        if reindexed or dropped:
+            self.changed = True
+        return reindexed, dropped
+        
+    def read_entry(self, name:str, stamp:list) -> dict:
+        """Read a note's title, preview, and hash from storage and return its entry."""
+        title, preview, size, note_hash = note_store.read_preview(
+                                          name, preview_length)
+        return {'stamp': stamp, 'title': title, 'preview': preview,
+                'size': size, 'hash': note_hash}
+        
+    def get_entry(self, path:str) -> dict:
+        """Return the entry for the note at path, or None if it is not indexed."""
+        return self.entries.get(os.path.basename(path))
+        
+    def get_notes(self) -> List[str]:
+        """Return the paths of all indexed notes, sorted by most recent first."""
+        return [os.path.join(notes_dir, name)
+                for name in sorted(self.entries, reverse=True)]
+        
+    def update(self, path:str, title:str, body:str, stamp:list):
+        """Record a note that was just saved with stamp."""
+        self.entries[os.path.basename(path)] = {
+            'stamp': stamp, 'title': title, 'preview': body[:preview_length],
+            'size': len(body.encode('utf-8')), 'hash': hash_note(title, body)}
+        self.changed = True
+        
+    def get_stamps(self) -> dict:
+        """Return the stamp of every indexed note, keyed by filename."""
+        return {name: entry['stamp'] for name, entry in self.entries.items()}
+        
+    def set_stamp(self, name:str, stamp:list):
+        """Give a note that was indexed without a stamp the stamp it was written with."""
+        entry = self.entries.get(name)
+        if entry is not None and entry['stamp'] is None:
+            entry['stamp'] = stamp
+            self.changed = True
+        
+    def get_hash(self, name:str) -> str:
+        """Return the content hash of a note, or None if it is not indexed."""
+        entry = self.entries.get(name)
+        return entry and entry['hash']
+        
+    def get_hashes(self) -> set:
+        """Return the content hashes of all indexed notes."""
+        return {entry['hash'] for entry in self.entries.values()}
+        
+    def remove(self, path:str):
+        """Forget the note at path."""
+        if self.entries.pop(os.path.basename(path), None) is not None:
+            self.changed = True
+        
+        
+note_index = NoteIndex(index_path)
+
+
+class SearchIndex:
+    """Inverted index of the words in every note's title and body.
+    
+    The index maps each lowercase word to the filenames of the notes that
+    contain it, so a query is answered from memory with set intersections
+    and never reads a note. It is kept current by index_note and
+    unindex_note, and saved next to notes_dir with the stamp each note had
+    when it was indexed. On load, notes whose stamps no longer match the
+    note index are read and indexed again.
+    
+    Loading is deferred to the first search, or done in the background by
+    the window: build reads the index file and the stale notes into a new
+    index without touching this one, so it can run on another thread, and
+    adopt takes that index over. Changes made before then are kept in
+    pending and applied on load.
+    
+    Args:
+        path (str): Absolute path to the index file.
+        
+    Attributes:
+        path (str): Absolute path to the index file.
+        loaded (bool): Whether the index file has been read.
+        docs (dict): [stamp, words] of each note, keyed by filename.
+        postings (dict): Set of filenames containing each word.
+        vocabulary (list): Sorted words of postings, or None if out of date.
+        pending (dict): Changes made before loading, keyed by filename. A
+                        value of None means the note was removed.
+        changed (bool): Whether docs differ from the index file on disk.
+        generation (int): Number of changes made to the index, used to tell
+                          when search results are out of date.
+        
+    """
+    
+    version = 2
+    
+    def __init__(self, path:str):
+        """The constructor for SearchIndex class."""
+        self.path = path
+        self.loaded = False
+        self.docs = {}
+        self.postings = {}
+        self.vocabulary = None
+        self.pending = {}
+        self.changed = False
+        self.generation = 0
+        
+    @trace.timed
+    def load(self):
+        """Read the index file, apply pending changes, and reindex stale notes."""
+        self.adopt(self.build(note_index.get_stamps()))
+        
+    @trace.timed
+    def build(self, stamps:dict) -> 'SearchIndex':
+        """Return a new index read from the index file and brought up to date with stamps.
+        
+        stamps holds the stamp of every note, keyed by filename. Notes whose
+        doc has a different stamp are read and indexed again.
+        """
+        index = SearchIndex(self.path)
+        try:
+            fp = open(self.path, 'r')
+            data = json.load(fp)
+            fp.close()
+        except (OSError, ValueError):
+            data = {}
+        if data.get('version') == self.version:
+            for name, doc in data['notes'].items():
+                index.add_doc(name, doc)
+            index.changed = False
+        else:
+            index.changed = True
+        for name in index.docs.keys() - stamps.keys():
+            index.remove_doc(name)
+        for name, stamp in stamps.items():
+            doc = index.docs.get(name)
+            if doc is None or doc[0] != stamp:
+                try:
+                    words = get_tokens('\n'.join(save_queue.read(name)))
+                except (OSError, KeyError):
+                    # deleted since; adopt catches up with it
+                    continue
+                index.remove_doc(name)
+                index.add_doc(name, [stamp, words])
+        return index
+        
+    @trace.timed
+    def adopt(self, index:'SearchIndex'):
+        """Take over the docs of an index returned by build and apply pending changes.
+        
+        Notes changed since build was given their stamps are reindexed.
+        """
+        self.docs = index.docs
+        self.postings = index.postings
+        self.vocabulary = None
+        self.changed = index.changed
+        self.generation += 1
+        self.loaded = True
+        
+        for name, doc in self.pending.items():
+            self.remove_doc(name)
+            if doc is not None:
+                self.add_doc(name, doc)
+        self.pending = {}
+        self.refresh()
+        
+    @trace.timed
+    def save(self):
+        """Write the index file to disk if it is loaded and changed."""
+        if not self.loaded or not self.changed:
+            return
+        temp_path = self.path + '.tmp'
+        fp = open(temp_path, 'w')
+        json.dump({'version': self.version, 'notes': self.docs}, fp,
+                  separators=(',', ':'))
+        fp.close()
+        os.replace(temp_path, self.path)
+        self.changed = False
+        
+    @trace.timed
+    def refresh(self, names:set=None):
+        """Reindex the notes that changed on disk since they were indexed.
+        
+        Every note is checked, unless names is given. Nothing is done before
+        the index is loaded, since loading checks every note anyway.
+        """
+        if not self.loaded:
+            return
+        if names is None:
+            names = self.docs.keys() | note_index.entries.keys()
+        for name in names:
+            entry = note_index.entries.get(name)
+            doc = self.docs.get(name)
+            if entry is None:
+                self.remove_doc(name)
+            elif doc is None or doc[0] != entry['stamp']:
+                words = get_tokens('\n'.join(save_queue.read(name)))
+                self.remove_doc(name)
+                self.add_doc(name, [entry['stamp'], words])
+        
+    def add_doc(self, name:str, doc:list):
+        """Add a note's words to the index."""
+        self.docs[name] = doc
+        for word in doc[1]:
+            names = self.postings.get(word)
+            if names is None:
+                self.postings[word] = {name}
+                self.vocabulary = None
+            else:
+                names.add(name)
+        self.changed = True
+        self.generation += 1
+        
+    def remove_doc(self, name:str):
+        """Remove a note's words from the index."""
+        doc = self.docs.pop(name, None)
+        if doc is None:
+            return
+        for word in doc[1]:
+            names = self.postings[word]
+            names.discard(name)
+            if not names:
+                del self.postings[word]
+                self.vocabulary = None
+        self.changed = True
+        self.generation += 1
+        
+    def update(self, path:str, title:str, body:str):
+        """Index a note that was just written to disk and added to note_index."""
+        name = os.path.basename(path)
+        entry = note_index.get_entry(path)
+        doc = [entry['stamp'], get_tokens('\n'.join([title, body]))]
+        if not self.loaded:
+            self.pending[name] = doc
+            return
+        self.remove_doc(name)
+        self.add_doc(name, doc)
+        
+    def set_stamp(self, name:str, stamp:list):
+        """Give a note that was indexed without a stamp the stamp it was written with."""
+        doc = self.pending.get(name) or self.docs.get(name)
+        if doc is not None and doc[0] is None:
+            doc[0] = stamp
+            self.changed = True
+        
+    def remove(self, path:str):
+        """Forget a deleted note."""
+        name = os.path.basename(path)
+        if not self.loaded:
+            self.pending[name] = None
+            self.generation += 1
+            return
+        self.remove_doc(name)
+        
+    def get_prefixed(self, prefix:str) -> set:
+        """Return the filenames of notes containing a word that starts with prefix."""
+        if self.vocabulary is None:
+            self.vocabulary = sorted(self.postings)
+        names = set()
+        index = bisect.bisect_left(self.vocabulary, prefix)
+        while index < len(self.vocabulary) and \
+              self.vocabulary[index].startswith(prefix):
+            names.update(self.postings[self.vocabulary[index]])
+            index += 1
+        return names
+        
+    @trace.timed
+    def search(self, query:str) -> set:
+        """Return the filenames of notes that contain every word in query.
+        
+        The last word of the query also matches longer words that start with
+        it, unless it is followed by a space, so that results narrow as the
+        query is typed. A last word shorter than min_prefix_length is only
+        matched whole, since nearly every note has a word starting with any
+        one letter and gathering them all would be slow.
+        """
+        if not self.loaded:
+            self.load()
+        words = word_regex.findall(query.lower())
+        if not words:
+            return set(self.docs)
+        if query[-1:].isspace() or len(words[-1]) < min_prefix_length:
+            matches = [self.postings.get(word, set()) for word in words]
+        else:
+            matches = [self.postings.get(word, set()) for word in words[:-1]]
+            matches.append(self.get_prefixed(words[-1]))
+        matches.sort(key=len)
+        return matches[0].intersection(*matches[1:])
+        
+        
+search_index = SearchIndex(search_path)
+
+
+class ImportIndex:
+    """Filenames that imported notes were saved under, keyed by their source.
+    
+    A note's source is the name of its Takeout file without the extension,
+    which is the same for its html and json files and from one export to
+    the next. When a note is imported again with a different title or body,
+    for example after it was edited in Keep, and the note it was saved as
+    is still stored, that note is replaced rather than a copy being added.
+    
+    Args:
+        path (str): Absolute path to the index file.
+        
+    Attributes:
+        path (str): Absolute path to the index file.
+        loaded (bool): Whether the index file has been read.
+        names (dict): Filename of the note imported from each source.
+        changed (bool): Whether names differ from the index file on disk.
+        
+    """
+    
+    def __init__(self, path:str):
+        """The constructor for ImportIndex class."""
+        self.path = path
+        self.loaded = False
+        self.names = {}
+        self.changed = False
+        
+    def load(self):
+        """Read the index file from disk, once."""
+        if self.loaded:
+            return
+        self.loaded = True
+        try:
+            fp = open(self.path, 'r')
+            self.names.update(json.load(fp))
+            fp.close()
+        except (OSError, ValueError):
+            pass
+        
+    def save(self):
+        """Write the index file to disk if any name changed since the last save."""
+        if not self.changed:
+            return
+        temp_path = self.path + '.tmp'
+        fp = open(temp_path, 'w')
+        json.dump(self.names, fp, separators=(',', ':'))
+        fp.close()
+        os.replace(temp_path, self.path)
+        self.changed = False
+        
+    def get_stored(self, source:str) -> str:
+        """Return the filename of the note imported from source, or None if it is not stored."""
+        filename = self.names.get(get_import_key(source))
+        if filename is None or note_store.stat(filename) is None:
+            return None
+        return filename
+        
+    def add(self, source:str, path:str):
+        """Record that the note imported from source was saved at path."""
+        key = get_import_key(source)
+        filename = os.path.basename(path)
+        if self.names.get(key) != filename:
+            self.names[key] = filename
+            self.changed = True
+        
+        
+import_index = ImportIndex(imports_path)
+
+
+class NoteWatcher:
+    """Detection of notes added, changed, or removed by other programs.
+    
+    With a FileStore on Linux, notes_dir is watched with inotify, and only
+    the files named in its events are checked, so picking up a change costs
+    the same however many notes there are. A LogStore reads just the records
+    appended to the log since it was last read. Otherwise, or when the
+    kernel's event queue overflowed, the stamp of every note is compared
+    with the note index, which for a FileStore is one scandir pass.
+    
+    Changes made by this program are already in the note index when they
+    are checked, or still in save_queue, so they are not reported.
+    
+    Args:
+        directory (str): Absolute path to the folder of note files.
+        
+    Attributes:
+        directory (str): Absolute path to the folder of note files.
+        fd (int): inotify file descriptor, or None if not watching.
+        supported (bool): Whether the system has inotify.
+        
+    """
+    
+    flags = 0o4000 | 0o2000000
+    mask = 0x8 | 0x40 | 0x80 | 0x100 | 0x200 | 0x400 | 0x800
+    overflow_mask = 0x400 | 0x800 | 0x4000 | 0x8000
+    event_header = struct.Struct('iIII')
+    
+    def __init__(self, directory:str):
+        """The constructor for NoteWatcher class."""
+        self.directory = directory
+        self.fd = None
+        self.supported = True
+        self.start()
+        
+    def start(self):
+        """Start watching directory with inotify, if possible."""
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(self.flags)
+        except (OSError, AttributeError):
+            self.supported = False
+            return
+        if fd < 0:
+            self.supported = False
+            return
+        if libc.inotify_add_watch(fd, os.fsencode(self.directory),
+                                  self.mask) < 0:
+            os.close(fd)
+            return
+        self.fd = fd
+        
+    def stop(self):
+        """Stop watching."""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        
+    def get_names(self) -> set:
+        """Return the names of the notes that may have changed since last time.
+        
+        Returns None when any note may have changed.
+        """
+        if isinstance(note_store, LogStore):
+            note_store.refresh()
+            return note_store.take_touched()
+        if self.fd is None:
+            if self.supported:
+                self.start()
+            return None
+            
+        names = set()
+        while True:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                return names
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = \
+                    self.event_header.unpack_from(data, offset)
+                offset += self.event_header.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & self.overflow_mask:
+                    self.stop()
+                    return None
+                name = os.fsdecode(name)
+                if name.endswith('.note'):
+                    names.add(name)
+        
+    @trace.timed
+    def poll(self) -> tuple:
+        """Bring the indexes up to date with the notes changed since last time.
+        
+        Returns the set of names of notes that were added or changed and the
+        set of names of notes that were removed.
+        """
+        names = self.get_names()
+        if names is not None and not names:
+            return set(), set()
+        changed, removed = note_index.refresh(names)
+        search_index.refresh(changed | removed)
+        return changed, removed
+        
+        
+class SaveQueue:
+    """Write-behind queue that saves notes to note_store on a background thread.
+    
+    Saving a note used to write it on the caller's thread, which for the
+    window is the Tk thread. Saves and deletes are instead recorded here and
+    written by a writer thread, a short while after the first of them, in
+    one note_store.write_batch call. A note saved several times before the
+    writer gets to it is written once, with its latest title and body, and
+    the batch shares a single sync.
+    
+    Notes are indexed as soon as they are saved, but without a stamp, since
+    it is only known once the note is written. The stamps are handed back
+    by drain, and note_index skips notes that are still queued, so a note
+    is never dropped for not being on disk yet. Reads of a queued note are
+    answered from the queue.
+    
+    Attributes:
+        pending (dict): (title, body) of each note waiting to be written, or
+                        None for a note waiting to be deleted, keyed by name.
+        writing (dict): The batch being written, keyed the same way.
+        stamps (dict): Stamp of each note written since the last drain,
+                       keyed by name.
+        lock (obj): Condition that guards the attributes and wakes the
+                    writer.
+        stopping (bool): Whether the writer should finish once pending is
+                         empty.
+        thread (obj): The writer thread, or None if it is not running.
+        
+    """
+    
+    def __init__(self):
+        """The constructor for SaveQueue class."""
+        self.pending = {}
+        self.writing = {}
+        self.stamps = {}
+        self.lock = threading.Condition()
+        self.stopping = False
+        self.thread = None
+        
+    def write(self, name:str, title:str, body:str):
+        """Queue a note to be saved."""
+        self.put(name, (title, body))
+        
+    def delete(self, name:str):
+        """Queue a note to be deleted."""
+        self.put(name, None)
+        
+    def put(self, name:str, note:tuple):
+        """Queue a change to a note and make sure the writer is running."""
+        with self.lock:
+            self.pending[name] = note
+            if self.thread is None:
+                self.stopping = False
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.lock.notify()
+        
+    def read(self, name:str) -> tuple:
+        """Return the title and body of a note, queued or stored."""
+        with self.lock:
+            note = self.pending.get(name, self.writing.get(name, False))
+        if note is False:
+            return note_store.read(name)
+        if note is None:
+            raise FileNotFoundError(name)
+        return note
+        
+    def get_names(self) -> set:
+        """Return the names of the notes that are queued or being written."""
+        with self.lock:
+            return self.pending.keys() | self.writing.keys()
+        
+    def run(self):
+        """Write queued changes in batches until stopped."""
+        with self.lock:
+            while True:
+                self.lock.wait_for(lambda: self.pending or self.stopping)
+                if not self.pending:
+                    return
+                # let the saves that come right after this one join it
+                self.lock.wait_for(lambda: self.stopping, save_delay)
+                self.writing = self.pending
+                self.pending = {}
+                self.lock.release()
+                try:
+                    stamps = note_store.write_batch(self.writing)
+                except Exception:
+                    stamps = None
+                finally:
+                    self.lock.acquire()
+                if stamps is None:
+                    # leave the batch for drain to write and report
+                    for name, note in self.writing.items():
+                        self.pending.setdefault(name, note)
+                    self.writing = {}
+                    self.thread = None
+                    return
+                self.stamps.update(stamps)
+                self.writing = {}
+        
+    @trace.timed
+    def drain(self):
+        """Wait for every queued change to be written, and record the stamps.
+        
+        Whatever the writer could not write is written on this thread, so
+        that any error is raised here. The changes are then left queued, to
+        be written by the next save or drain.
+        """
+        with self.lock:
+            thread = self.thread
+            self.stopping = True
+            self.lock.notify()
+        if thread is not None:
+            thread.join()
+        with self.lock:
+            self.thread = None
+            pending = self.pending
+            self.pending = {}
+            stamps = self.stamps
+            self.stamps = {}
+        for name, stamp in stamps.items():
+            note_index.set_stamp(name, stamp)
+            search_index.set_stamp(name, stamp)
+        if not pending:
+            return
+        try:
+            stamps = note_store.write_batch(pending)
+        except Exception:
+            with self.lock:
+                for name, note in pending.items():
+                    self.pending.setdefault(name, note)
+            raise
+        for name, stamp in stamps.items():
+            note_index.set_stamp(name, stamp)
+            search_index.set_stamp(name, stamp)
+        
+        
+save_queue = SaveQueue()
+
+
+class KeepNoteParser(html.parser.HTMLParser):
+    """Single-pass extractor of the parts of a Takeout html note.
+    
+    A Keep note exported by Takeout is one html file with the note's title
+    in <title>, its date in a div of class heading, and its body in a div
+    of class content, with lines separated by <br>. The parser collects the
+    text of those three elements as it reads, without building a tree, and
+    stops once the content div is closed. Entities are unescaped. Tags
+    inside the content other than <br> are dropped and their text kept.
+    
+    Attributes:
+        title (str): Text of the <title> element.
+        heading (str): Text of the heading div.
+        lines (list): Text of the content div, split at each <br>, or None
+                      if the content div has not been found.
+        field (str): Part being read, 'title', 'heading', or 'content', or
+                     None between parts.
+        depth (int): Number of divs open inside the heading or content div.
+        done (bool): Whether the content div has been read.
+        
+    """
+    
+    def __init__(self):
+        """The constructor for KeepNoteParser class."""
+        super().__init__(convert_charrefs=True)
+        self.title = ""
+        self.heading = ""
+        self.lines = None
+        self.field = None
+        self.depth = 0
+        self.done = False
+        
+    def handle_starttag(self, tag:str, attrs:list):
+        """Start reading a part of the note, or note a line break or nested div."""
+        if self.field is None:
+            if tag == 'title':
+                self.field = 'title'
+            elif tag == 'div':
+                classes = (dict(attrs).get('class') or '').split()
+                if 'heading' in classes and not self.heading:
+                    self.field = 'heading'
+                elif 'content' in classes and self.lines is None:
+                    self.field = 'content'
+                    self.lines = [""]
+        elif tag == 'div':
+            self.depth += 1
+        elif tag == 'br' and self.field == 'content':
+            self.lines.append("")
+        
+    def handle_endtag(self, tag:str):
+        """Stop reading a part of the note when its element is closed."""
+        if self.field == 'title' and tag == 'title':
+            self.field = None
+        elif self.field in ('heading', 'content') and tag == 'div':
+            if self.depth:
+                self.depth -= 1
+            else:
+                self.done = self.field == 'content'
+                self.field = None
+        
+    def handle_data(self, data:str):
+        """Add text to the part of the note being read."""
+        if self.field == 'title':
+            self.title += data
+        elif self.field == 'heading':
+            self.heading += data
+        elif self.field == 'content':
+            self.lines[-1] += data
+        
+    def parse(self, fp:io.TextIOBase) -> tuple:
+        """Read an html note from fp, return its title, heading, and content lines."""
+        while not self.done:
+            chunk = fp.read(import_chunk_size)
+            if not chunk:
+                break
+            self.feed(chunk)
+        self.close()
+        if self.lines is None:
+            raise ValueError("no content in note")
+        return self.title, self.heading, self.lines
+        
+        
+def index_note(path:str, title:str, body:str, stamp:list):
+    """Record a note that was just saved in the note and search indexes."""
+    note_index.update(path, title, body, stamp)
+    search_index.update(path, title, body)
+    
+def unindex_note(path:str):
+    """Forget a deleted note in the note and search indexes."""
+    note_index.remove(path)
+    search_index.remove(path)
+    
+def hash_text(text:str) -> str:
+    """Return a hash of text."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+    
+def hash_note(title:str, body:str) -> str:
+    """Return the content hash of a note with title and body."""
+    return hash_text('\n'.join([title, body]))
+    
+def get_tokens(text:str) -> List[str]:
+    """Return the distinct lowercase words in text."""
+    return list(set(word_regex.findall(text.lower())))
+    
+def get_notes() -> List[str]:
+    """Return a list of all notes, sorted by most recent first."""
+    return note_index.get_notes()
+    
+def get_new_date(seconds:float=None) -> str:
+    """Return the formatted date according to the current time and date.
+    
+    If seconds is given, the date is that many seconds after the epoch.
+    """
+    current_time = time.localtime(seconds)
+    return "{}-{:02}-{:02}T{:02}_{:02}_{:02}.note".\
+            format(*current_time[0:6])
+        
+def format_lines(lines:List[str]) -> List[str]:
+    """Return lines of text stripped of newlines."""
+    return [re.split('\n', line)[0] for line in lines]
+    
+def split_body(body:str) -> List[str]:
+    """Split a note's body into lines, as readlines would."""
+    lines = body.split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    return lines
+    
+def sync_directory(directory:str):
+    """Flush the names of the files in directory to disk, where that is possible."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+        
+def check_for_directory():
+    """If note folder does not exist, create it with 700 permission."""
+    if not os.path.isdir(notes_dir):
+        os.makedirs(notes_dir, mode=0o700)
+        
+def get_import_sources(paths:List[str]) -> List[tuple]:
+    """Return an (archive, name) pair for each note to import from paths."""
+    return list(iter_import_sources(paths))
+    
+def iter_import_sources(paths:List[str], seen:set=None) -> Iterator[tuple]:
+    """Yield an (archive, name) pair for each note to import from paths.
+    
+    Html and json files are yielded as (None, path). Takeout puts a json
+    file with the same note next to each html file; when there is one, it
+    is yielded instead of the html file, since it is cheaper to read and
+    has exact dates. Takeout archives are not extracted; each note under a
+    Keep folder is yielded as (archive path, member name), to be read
+    straight from the archive. Directories are searched for notes and
+    archives. Each source is yielded once, seen holding those already
+    yielded.
+    """
+    if seen is None:
+        seen = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, subdirs, files in os.walk(path):
+                subdirs.sort()
+                yield from iter_import_sources(
+                           (os.path.join(directory, name)
+                            for name in sorted(files)), seen)
+        elif path[-4:] in ('html', 'json'):
+            json_path = path[:-4] + 'json'
+            if os.path.exists(json_path):
+                path = json_path
+            if path not in seen:
+                seen.add(path)
+                yield None, path
+        elif path[-4:] == '.zip':
+            with zipfile.ZipFile(path) as archive:
+                names = archive.namelist()
+            members = set(names)
+            for name in names:
+                if name[-5:] in ('.html', '.json') and \
+                   name.split('/')[-2:-1] == ['Keep']:
+                    json_name = name[:-4] + 'json'
+                    if json_name in members:
+                        name = json_name
+                    if (path, name) not in seen:
+                        seen.add((path, name))
+                        yield path, name
+        
+def open_import_source(archive:str, name:str) -> io.TextIOBase:
+    """Open an html file, or one member of a Takeout archive, for reading."""
+    if archive is None:
+        return open(name)
+    if archive not in open_archives:
+        open_archives[archive] = zipfile.ZipFile(archive)
+    return io.TextIOWrapper(open_archives[archive].open(name), encoding='utf-8')
+    
+def is_bundle(path:str) -> bool:
+    """Return whether path is a bundle of notes written by export."""
+    return path.endswith(('.jsonl', '.jsonl.gz'))
+    
+def open_bundle(path:str, mode:str='r', compressed:bool=None) -> io.TextIOBase:
+    """Open a bundle of notes for reading or writing.
+    
+    A bundle holds one note per line, as a JSON object with the note's
+    filename, title, and body, so that it can be written and read one note
+    at a time. It is gzipped if compressed is true, or, if compressed is not
+    given, if path ends with .gz.
+    """
+    if compressed is None:
+        compressed = path.endswith('.gz')
+    if compressed:
+        return gzip.open(path, mode + 't', encoding='utf-8',
+                         compresslevel=bundle_compress_level)
+    return open(path, mode, encoding='utf-8')
+    
+def get_bundle_line(name:str) -> str:
+    """Return a stored note as a line of a bundle."""
+    title, body = note_store.read(name)
+    return json.dumps({'name': name, 'title': title, 'body': body},
+                      ensure_ascii=False) + '\n'
+        
+def read_bundle(path:str) -> Iterator[tuple]:
+    """Yield (name, title, body) for each note in a bundle, or None for bad lines."""
+    fp = open_bundle(path, 'r')
+    try:
+        for line in fp:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                name = str(record['name'])
+                note = name, str(record['title']), str(record['body'])
+            except (ValueError, KeyError, TypeError):
+                yield None
+                continue
+            if name.endswith('.note') and name == os.path.basename(name):
+                yield note
+            else:
+                yield None
+    finally:
+        fp.close()
+        
+def init_worker(trace_path:str, start_time:float, hashes:set, imports:dict):
+    """Set up an import worker process.
+    
+    The worker traces to trace_path if it is set, timing its spans from
+    start_time, the parent's trace start, so that they line up with the
+    parent's spans in the merged trace. Notes whose content hash is in
+    hashes are skipped, since they are already stored, and imports holds
+    the names of import_index.
+    """
+    if trace_path:
+        trace.start(trace_path)
+        trace.start_time = start_time
+    known_hashes.update(hashes)
+    import_index.names.update(imports)
+    import_index.loaded = True
+    
+def import_batch(sources:List[tuple], first_run:bool) -> tuple:
+    """Import a batch of html files or archive members in a worker process.
+    
+    The notes of the batch are saved together with note_store.write_batch,
+    so they share one sync. A note whose source import_index knows replaces
+    the note it was saved as before. Any other note never replaces a stored
+    one: notes are often given the same filename, such as every note
+    imported in the same second, so a counter is added to the filename
+    until it is free. Returns a list of (path, title, body, stamp) for each
+    note that was saved, False for each note that was already stored, or
+    None for each source that could not be imported, and the trace events
+    and counters that the worker recorded.
+    """
+    notes = []
+    for archive, name in sources:
+        try:
+            notes.append(import_file(archive, name, first_run))
+        except Exception:
+            notes.append(None)
+    filenames = [note and os.path.basename(note[0]) for note in notes]
+    unsaved = []
+    replaced = {}
+    for index, (archive, name) in enumerate(sources):
+        stored = notes[index] and import_index.get_stored(name)
+        if stored:
+            path, title, body = notes[index]
+            notes[index] = os.path.join(notes_dir, stored), title, body
+            replaced[stored] = title, body
+        elif notes[index]:
+            unsaved.append(index)
+    try:
+        stamps = note_store.write_batch(replaced)
+        while unsaved:
+            changes = {}
+            for index in unsaved:
+                path, title, body = notes[index]
+                filename = get_free_filename(filenames[index],
+                                             changes.keys() | stamps.keys())
+                notes[index] = os.path.join(notes_dir, filename), title, body
+                changes[filename] = title, body
+            # another worker may have taken some of the names meanwhile
+            stamps.update(note_store.write_batch(changes, replace=False))
+            unsaved = [index for index in unsaved
+                       if os.path.basename(notes[index][0]) not in stamps]
+    except OSError:
+        return [None if note else note for note in notes], trace.take()
+    results = [note and note + (stamps[os.path.basename(note[0])],)
+               for note in notes]
+    return results, trace.take()
+    
+@trace.timed
+def import_file(archive:str, name:str, first_run:bool) -> tuple:
+    """Parse an html or json source as a note, return (path, title, body).
+    
+    False is returned if a note with the same title and body is already
+    stored. The note is saved by import_batch.
+    """
+    fp = open_import_source(archive, name)
+    if name[-5:] == '.json':
+        with trace.span('parse'):
+            note = json.load(fp)
+        fp.close()
+        title = note.get('title', "")
+        lines = get_json_lines(note)
+        filename = get_json_filename(note, first_run)
+    else:
+        with trace.span('parse'):
+            html_title, heading, lines = KeepNoteParser().parse(fp)
+        fp.close()
+        title = get_title(html_title)
+        filename = get_filename(html_title, heading, name, first_run)
+    body = '\n'.join(format_lines(lines))
+    
+    note_hash = hash_note(title, body)
+    if note_hash in known_hashes:
+        return False
+    known_hashes.add(note_hash)
+    return os.path.join(notes_dir, filename), title, body
+    
+def get_import_key(source:str) -> str:
+    """Return the key of import_index for a Takeout file or archive member."""
+    return os.path.splitext(os.path.basename(source))[0]
+    
+def get_free_filename(filename:str, taken:set) -> str:
+    """Return filename, with a counter added if it is in taken or stored."""
+    base = filename[:-5]
+    number = 0
+    while filename in taken or note_store.stat(filename) is not None:
+        number += 1
+        filename = "{}-{}.note".format(base, number)
+    return filename
+    
+def get_json_lines(note:dict) -> List[str]:
+    """Return the lines of the body of a Takeout json note.
+    
+    Checklists have no text content. Each of their items becomes a line,
+    marked with a ticked or an empty box.
+    """
+    if 'listContent' in note:
+        return ["{} {}".format('\u2611' if item.get('isChecked') else '\u2610',
+                               item.get('text', ""))
+                for item in note['listContent']]
+    return note.get('textContent', "").split('\n')
+    
+def get_json_filename(note:dict, first_run:bool) -> str:
+    """Return the new filename for a Takeout json note, from its timestamps.
+    
+    The note keeps the time it was last edited, or else created, as it is
+    recorded in the json in microseconds.
+    """
+    usec = note.get('userEditedTimestampUsec') or \
+           note.get('createdTimestampUsec')
+    if first_run and usec:
+        return get_new_date(usec / 1000000)
+    return get_new_date()
+    
+def get_title(html_title:str) -> str:
+    """Return the title of the note, or an empty string if none."""
+    if not date_regex.match(html_title):
+        # note has a title
+        return html_title
+    else:
+        # note does not have a title
+        return ""
+        
+def get_filename(html_title:str, heading:str, path:str,
+                 first_run:bool) -> str:
+    """Return the new filename for the note, which is equal to its creation date."""
+    if not date_regex.match(html_title) and first_run:
+        return process_date(date_regex.search(heading).group())
+    elif first_run:
+        return os.path.basename(path)[:-15] + '.note'
+    else:
+        return get_new_date()
+        
+def process_date(date:str) -> str:
+    """Convert a date string into a date/filename string, return it."""
+    months = {'Jan': '01', 'Feb': '02', 'Mar': '03', 'Apr': '04',
+              'May': '05', 'Jun': '06', 'Jul': '07', 'Aug': '08',
+              'Sep': '09', 'Oct': '10', 'Nov': '11', 'Dec': '12'}
+        
+    year = re.search('\d\d\d\d', date).group()
+    month = months[date[0:3]]
+    day = int(re.search('\d\d?(?=,)', date).group())
+    hour = int(re.search('(?<= )\d\d?(?=:)', date).group())
+    minute = int(re.search('(?<=:)\d\d(?=:)', date).group())
+    second = int(re.search('(?<=:)\d\d(?= )', date).group())
+    
+    daytime_bool = re.search('AM', date)
+    if not daytime_bool:
+        hour = hour + 12
+        
+    return "{}-{}-{:02}T{:02}_{:02}_{:02}.note".format(year,
+                                                       month,
+                                                       day,
+                                                       hour,
+                                                       minute,
+                                                       second)
+        
+def migrate_notes():
+    """Move every note from notes_dir into a LogStore, once."""
+    global note_store
+    if isinstance(note_store, LogStore):
+        return
+    files = note_store
+    log = LogStore(log_path)
+    names = [name for name, stamp in files.scan()]
+    log.write_batch({name: files.read(name) for name in names})
+    log.close()
+    for name in names:
+        files.delete(name)
+    note_store = log
+    
\ No newline at end of file
@@ -1,24 +1,41 @@
 from typing import List
-import glob
+import bisect
+import functools
+import heapq
+import itertools
+import json
+import multiprocessing
 import tkinter as tk
 from tkinter import filedialog
 from tkinter import messagebox
 from tkinter import font as tkfont
-import bs4
+import cli
+import core
 import os
+import queue
 import re
-import time
+import sys
+import threading
 
-main_dir = os.path.expanduser('~/.local/share/keeper')
-notes_dir = os.path.join(main_dir, 'notes')
+import_batch_size = 50
+import_poll_ms = 100
+resize_delay_ms = 150
+rewrap_poll_ms = 20
+watch_poll_ms = 1000
+load_batch_size = 500
+load_poll_ms = 10
+layout_cache_sizes = 4
 
 main_background_color = '#E6E6E6'
 box_color = '#FAFAFA'
+selected_color = '#D2E3FC'
 gap = 10
+canvas_items = False
 
-root = tk.Tk()
-root.title("Keeper")
-font = tkfont.Font()
+root = None
+font = None
+
+non_blank_regex = re.compile('\S')
 
 
 class FirstRunView(tk.Frame):
@@ -59,7 +76,7 @@ class FirstRunView(tk.Frame):
         
         for widget in (l1, b1, b2):
             widget.pack()
-            
+        
     def create_first_note(self, event:tk.Tk):
         """Create the first note of the program."""
         open_EditText()
@@ -74,35 +91,109 @@ class ScrollableNoteBoxView(tk.Frame):
     """The main view of the program, displays all notes.
     
     This view is created when the program loads and is hidden/shown when needed.
-    The view consists of four layers:
+    The view consists of three layers:
     Layer 1: A frame that fills the entire window area.
-    Layer 2: The grid contents. These include the canvas on which everything
-             else is drawn, the scrollbar, and padding spaces.
-    Layer 3: The frame(s) that structure the noteboxes.
-    Layer 4: The notebox(es).
+    Layer 2: The grid contents. These include the search box, the canvas on
+             which everything else is drawn, the scrollbar, and padding
+             spaces.
+    Layer 3: The notebox label(s), drawn as windows on the canvas.
+    
+    The view is virtualized. Every note has a notebox that knows its text,
+    height, and position in the columns, but only the noteboxes inside or near
+    the visible part of the canvas are given a label to be drawn with. Labels
+    are kept in a pool and handed from notebox to notebox as the view scrolls,
+    so the number of widgets stays roughly constant no matter how many notes
+    there are.
+    
+    Layout is incremental. Adding, removing, or changing a box only marks the
+    layout dirty from that box's index onward. refresh_frames then cuts each
+    column back to the boxes before that index and places the rest again,
+    taking the shortest column from a heap. Only the labels of boxes that are
+    in view are moved.
+    
+    Typing in the search box filters the view on each keystroke. Boxes whose
+    notes do not match the query are skipped by the layout and take up no
+    space.
+    
+    Noteboxes can be selected with Control-click, and Shift-click selects
+    every box between the last one selected and the one clicked. Operations
+    on the selection, such as delete_selected, work on all the boxes in one
+    pass and redo the layout once. Escape clears the selection.
     
     Args:
         parent: Tkinter object that will contain the class.
         background (optional): Tkinter color (defined word, 6-digit hex, etc.)
                                for background.
-    
+        
     Attributes:
-        frame_list (list): List of all frames on the drawing canvas.
-        box_list (list): List of all boxes created, independent from frames.
-        frame_width (int): Width of frames (same for all).
-        num_frames (int): Number of frames, calculated at init and when window
+        frame_list (list): Noteboxes in each column, ordered top to bottom.
+        frame_tops (list): Top positions of the noteboxes in each column,
+                           parallel to frame_list.
+        frame_indices (list): Indices in box_list of the noteboxes in each
+                              column, parallel to frame_list.
+        frame_heights (list): Current height in pixels of each column.
+        frame_heap (list): Heap of (height, column) pairs, used to find the
+                           shortest column.
+        box_list (list): List of all boxes created, independent from columns.
+        box_index (dict): Index in box_list of each notebox, valid up to
+                          layout_start.
+        box_names (dict): Notebox of each saved note in box_list, keyed by
+                          filename.
+        layout_start (int): Index in box_list of the first box whose position
+                            is out of date.
+        search_results (set): Filenames of the notes that match the search
+                              query, or None if there is no query.
+        search_generation (int): search_index.generation when search_results
+                                 was computed.
+        resize_after (str): Id of the scheduled resize, or None.
+        rewrap_job (obj): RewrapJob in progress, or None.
+        watcher (obj): core.NoteWatcher reporting notes changed by other
+                       programs, or None before init.
+        load_job (obj): LoadJob creating the noteboxes below the first
+                        screenful, or None once they are all created.
+        import_jobs (int): Number of ImportJobs in progress. Changes are not
+                           picked up from the watcher while notes are being
+                           imported or loaded.
+        selected (set): Noteboxes that are selected.
+        selection_anchor (obj): Notebox that was last selected or
+                                unselected, where Shift-click starts from.
+        shown_boxes (set): Noteboxes that currently have a label.
+        label_pool (list): Labels that are not attached to any notebox. These
+                           are NoteBoxItems instead if canvas_items is set.
+        frame_width (int): Width of columns (same for all).
+        num_frames (int): Number of columns, calculated at init and when window
                           size changes.
         max_width (int): Maximum width in pixels of text that a box can
                          display.
         max_lines (int): Maximum rows of text that a box can hold.
-    
+        line_height (int): Height in pixels of one line of text.
+        box_padding (int): Height in pixels a box adds around its text.
+        
     """
     
     def __init__(self, parent:tk.Tk, background:str=main_background_color):
         """The constructor for ScrollableNoteBoxView class."""
         super().__init__(parent, background=background)
         self.frame_list = []
+        self.frame_tops = []
+        self.frame_indices = []
+        self.frame_heights = []
+        self.frame_heap = []
         self.box_list = []
+        self.box_index = {}
+        self.box_names = {}
+        self.layout_start = 0
+        self.search_results = None
+        self.search_generation = 0
+        self.resize_after = None
+        self.rewrap_job = None
+        self.watcher = None
+        self.load_job = None
+        self.import_jobs = 0
+        self.selected = set()
+        self.selection_anchor = None
+        self.shown_boxes = set()
+        self.label_pool = []
         self.frame_width = 0
         
         self.pack(expand=True, fill='both')
@@ -113,9 +204,12 @@ class ScrollableNoteBoxView(tk.Frame):
         self.grid_columnconfigure(0, minsize=gap)
         self.grid_columnconfigure(2, minsize=gap)
         
+        self.search_var = tk.StringVar(self)
+        self.search_entry = tk.Entry(self, textvariable=self.search_var,
+                                     background=box_color, font=font)
         self.canvas = tk.Canvas(self, background=background, borderwidth=0,
                                 highlightthickness=0)
-        self.scrollbar = tk.Scrollbar(self, command=self.canvas.yview,
+        self.scrollbar = tk.Scrollbar(self, command=self.on_scrollbar,
                                       background=background, width=3)
         self.new_button = tk.Button(self, text="+", padx=0,
                                     background=background,
@@ -123,25 +217,44 @@ class ScrollableNoteBoxView(tk.Frame):
         self.import_button = tk.Button(self, text="\u2026", padx=0,
                                        background=background,
                                        activebackground=background)
+        self.progress_label = tk.Label(self, background=background)
         
+        self.search_entry.grid(row=0, column=1, sticky='we', pady=gap//2)
         self.canvas.grid(row=1, column=1, sticky='nesw')
         self.scrollbar.grid(row=0, column=3, sticky='nesw', rowspan=3)
         self.canvas.config(yscrollcommand=self.scrollbar.set)
         
+        self.search_var.trace_add('write', self.on_search)
         self.new_button.bind('<Button-1>', self.new_note)
         self.import_button.bind('<Button-1>', self.import_files)
         self.canvas.bind_all('<Button-4>', self.on_mouse_wheel)
         self.canvas.bind_all('<Button-5>', self.on_mouse_wheel)
         self.bind('<Configure>', self.resize_window)
+        root.bind('<Delete>', self.on_delete_key)
+        root.bind('<Escape>', self.clear_selection)
+        
+        self.get_box_metrics()
         
+    @core.trace.timed
     def init(self):
-        """Set up the view."""
+        """Set up the view.
+        
+        Only the newest notes, enough to fill the window twice over, are
+        given noteboxes before the view is drawn. A LoadJob creates the rest
+        in the background.
+        """
         self.get_sizes()
-        self.create_frames()
-        self.create_boxes()
-        self.display_all()
+        notes = core.get_notes()
+        view_height = max(self.canvas.winfo_height(), root.winfo_height())
+        first = 2 * self.num_frames * \
+                (view_height // self.get_box_height(1) + 1)
+        self.create_boxes(notes[:first])
+        self.refresh_frames()
         self.place_buttons()
         self.lift_buttons()
+        self.watcher = core.NoteWatcher(core.notes_dir)
+        self.load_job = LoadJob(self, notes[first:])
+        self.after(watch_poll_ms, self.poll_watcher)
         
     def new_note(self, event:tk.Tk):
         """Open an EditText window to create a new note."""
@@ -151,14 +264,59 @@ class ScrollableNoteBoxView(tk.Frame):
         """Open a tkinter filedialog, choose file(s) to import, and import them."""
         open_import_dialog(self)
         
+    def on_search(self, *args):
+        """Filter the noteboxes by the search query and redraw the view."""
+        self.update_search(force=True)
+        self.canvas.yview_moveto(0)
+        self.refresh_frames()
+        
+    @core.trace.timed
+    def update_search(self, force:bool=False):
+        """Recompute the search results if the query or the notes changed."""
+        query = self.search_var.get()
+        if not query.strip():
+            results = None
+        elif not core.search_index.loaded:
+            # SearchJob searches again once the index is loaded
+            results = None
+        elif force or core.search_index.generation != self.search_generation:
+            results = core.search_index.search(query)
+        else:
+            return
+        self.search_generation = core.search_index.generation
+        if results != self.search_results:
+            self.search_results = results
+            self.invalidate_layout()
+        
     def on_mouse_wheel(self, event:tk.Tk):
         """Bind mouse wheel to scrolling."""
         self.canvas.yview_scroll(-1 if event.num == 4 else 1, 'units')
+        self.display_visible()
+        
+    def on_scrollbar(self, *args):
+        """Scroll the canvas from the scrollbar and show the boxes now in view."""
+        self.canvas.yview(*args)
+        self.display_visible()
+        
+    def get_box_metrics(self):
+        """Measure the line height and the padding a label adds to its text."""
+        probe = tk.Label(self.canvas, font=font)
+        self.line_height = font.metrics('linespace')
+        self.box_padding = probe.winfo_reqheight() - self.line_height
+        probe.destroy()
+        core.trace.count('widgets_created')
+        core.trace.count('widgets_destroyed')
         
+    def get_box_height(self, num_lines:int) -> int:
+        """Return the height in pixels of a box displaying num_lines lines."""
+        return max(num_lines, 1) * self.line_height + self.box_padding
+        
+    @core.trace.timed
     def get_sizes(self):
         """Calculate sizes for the columns, noteboxes, and text."""
         root.update_idletasks()
         
+        text_layout.check_font()
         self.window_width = root.winfo_width()
         self.window_height = root.winfo_height()
         
@@ -174,99 +332,311 @@ class ScrollableNoteBoxView(tk.Frame):
         if not self.max_lines:
             self.max_lines = 1
         
-    def delete_frames(self):
-        """Delete all frames on the canvas."""
-        items = self.canvas.find_all()
-        children = self.canvas.winfo_children()
-        for index, child in enumerate(children):
-            self.canvas.delete(items[index])
-            child.destroy()
-        self.frame_list.clear()
-
     def create_frames(self):
-        """Create num_frames frames, do not place on canvas yet."""
-        for frame in range(self.num_frames):
-            frame = tk.Frame(self.canvas, width=self.frame_width,
-                             background=main_background_color)
-            frame.height = 0
-            self.frame_list.append(frame)
-            frame.pack_propagate(0)
-
-    def get_next_frame(self, frames:List[tk.Tk]) -> tk.Tk:
-        """Return the next (shortest) frame that a notebox should be added to."""
-        shortest = min(frame.height for frame in frames)
-        return next(frame for frame in frames if frame.height == shortest)
+        """Create num_frames empty columns."""
+        self.frame_list = [[] for frame in range(self.num_frames)]
+        self.frame_tops = [[] for frame in range(self.num_frames)]
+        self.frame_indices = [[] for frame in range(self.num_frames)]
+        self.frame_heights = [0] * self.num_frames
+        self.frame_heap = [(0, frame) for frame in range(self.num_frames)]
+        self.layout_start = 0
+        
+    def truncate_frames(self, index:int):
+        """Cut every column back to the boxes that come before index."""
+        for frame, indices in enumerate(self.frame_indices):
+            cut = bisect.bisect_left(indices, index)
+            del self.frame_list[frame][cut:]
+            del self.frame_tops[frame][cut:]
+            del indices[cut:]
+            if self.frame_list[frame]:
+                last = self.frame_list[frame][-1]
+                self.frame_heights[frame] = last.y - gap//2 + last.height + gap
+            else:
+                self.frame_heights[frame] = 0
+        self.frame_heap = [(height, frame) for frame, height
+                           in enumerate(self.frame_heights)]
+        heapq.heapify(self.frame_heap)
+        
+    def get_next_frame(self) -> int:
+        """Return the index of the next (shortest) column for a notebox."""
+        return self.frame_heap[0][1]
         
-    def get_list_index(self, obj:tk.Tk) -> int:
+    def get_list_index(self, obj:'NoteBox') -> int:
         """Return the index of the notebox in root's box_list."""
+        index = self.box_index.get(obj)
+        if index is not None and index < len(self.box_list) and \
+           self.box_list[index] is obj:
+            return index
         return next((index for index, box in enumerate(self.box_list)
                      if box is obj), None)
-    
-    def create_boxes(self):
-        """Create a notebox for each note in the stored folder."""
-        for note in get_notes():
-            notebox = self.create_box(note, self.max_width, self.max_lines)
-            self.assign_box(notebox)
-            
+        
+    def invalidate_layout(self, index:int=0):
+        """Mark the positions of the boxes from index onward as out of date."""
+        self.layout_start = min(self.layout_start, index)
+        
+    @core.trace.timed
+    def create_boxes(self, notes:List[str]):
+        """Create a notebox for each note in notes."""
+        for note in notes:
+            self.create_box(note, self.max_width, self.max_lines)
+        
     def create_box(self, path:str=None, width:int=0, lines:int=1,
-                   new:bool=False) -> tk.Tk:
+                   new:bool=False) -> 'NoteBox':
         """Create and return a notebox and place it into root's box_list."""
         notebox = NoteBox(self, path=path, width=width, lines=lines)
         if new:
-            self.box_list.insert(0, notebox)
+            self.insert_box(0, notebox)
         else:
-            self.box_list.append(notebox)
+            self.insert_box(len(self.box_list), notebox)
         return notebox
         
-    def assign_box(self, box:tk.Tk):
-        """Pack a notebox into the next available frame."""
-        frame = self.get_next_frame(self.frame_list)
-        box.pack(in_=frame, fill='x', pady=(gap//2))
-        frame.height += box.height + gap
-            
-    def reassign_boxes(self):
-        """Repack all the boxes into the frames."""
-        for notebox in self.box_list:
-            self.assign_box(notebox)
-            
-    def insert_box(self, index:int, notebox:tk.Tk):
+    def assign_box(self, box:'NoteBox', index:int):
+        """Position a notebox at the bottom of the next available column."""
+        frame = self.get_next_frame()
+        x = frame * (self.frame_width + gap)
+        y = self.frame_heights[frame] + gap//2
+        if box.label and (box.x, box.y) != (x, y):
+            box.label.move(x, y)
+        box.x = x
+        box.y = y
+        self.frame_list[frame].append(box)
+        self.frame_tops[frame].append(y)
+        self.frame_indices[frame].append(index)
+        self.frame_heights[frame] += box.height + gap
+        heapq.heapreplace(self.frame_heap, (self.frame_heights[frame], frame))
+        self.box_index[box] = index
+        
+    def reassign_boxes(self, start:int=0):
+        """Reposition the boxes from start onward into the columns.
+        
+        Boxes that do not match the search query are not placed.
+        """
+        results = self.search_results
+        for index in range(start, len(self.box_list)):
+            box = self.box_list[index]
+            if results is None or box.get_name() in results:
+                self.assign_box(box, index)
+            else:
+                self.box_index[box] = index
+        
+    def insert_box(self, index:int, notebox:'NoteBox'):
         """Place a notebox into root's box_list at index."""
         self.box_list.insert(index, notebox)
-                
-    def remove_box(self, notebox:tk.Tk, from_button:bool=False):
+        if notebox.path:
+            self.box_names[notebox.get_name()] = notebox
+        self.invalidate_layout(index)
+        
+    @core.trace.timed
+    def insert_boxes(self, index:int, noteboxes:List['NoteBox']):
+        """Place several noteboxes into root's box_list, starting at index."""
+        self.box_list[index:index] = noteboxes
+        for notebox in noteboxes:
+            if notebox.path:
+                self.box_names[notebox.get_name()] = notebox
+        self.invalidate_layout(index)
+        
+    def get_insert_index(self, name:str) -> int:
+        """Return where the notebox of the note called name goes in box_list.
+        
+        box_list is ordered by filename, newest first, apart from imported
+        notes, which are put at the top until the next start.
+        """
+        low = 0
+        high = len(self.box_list)
+        while low < high:
+            middle = (low + high) // 2
+            if (self.box_list[middle].get_name() or '') > name:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+        
+    def remove_box(self, notebox:'NoteBox', from_button:bool=False):
         """Remove notebox from root's box_list, do not destroy the object."""
-        index = self.get_list_index(notebox)
-        if index is not None:
-            del self.box_list[index]
+        self.remove_boxes([notebox], from_button=from_button)
+        
+    @core.trace.timed
+    def remove_boxes(self, noteboxes:List['NoteBox'], from_button:bool=False):
+        """Remove several noteboxes from root's box_list, do not destroy them.
+        
+        box_list is filtered in one pass from the first of the boxes, and the
+        layout is marked out of date from there once. If from_button, the
+        view is then redrawn, or the welcome screen shown if no box is left.
+        """
+        removed = set(noteboxes)
+        start = next((index for index, box in enumerate(self.box_list)
+                      if box in removed), None)
+        if start is not None:
+            self.box_list[start:] = [box for box in self.box_list[start:]
+                                     if box not in removed]
+            self.invalidate_layout(start)
+        for notebox in removed:
+            self.box_index.pop(notebox, None)
+            if self.box_names.get(notebox.get_name()) is notebox:
+                del self.box_names[notebox.get_name()]
+            self.hide_box(notebox)
+            self.selected.discard(notebox)
         if from_button:
             if self.box_list:
                 self.refresh_frames()
             else:
-                startWelcome()
+                self.show_welcome()
+        
+    def show_welcome(self):
+        """Hide the view and show the welcome screen."""
+        self.pack_forget()
+        FirstRunView(root)
+        
+    def toggle_selection(self, notebox:'NoteBox'):
+        """Select the notebox, or unselect it if it is selected."""
+        if notebox in self.selected:
+            self.selected.discard(notebox)
+        else:
+            self.selected.add(notebox)
+        self.selection_anchor = notebox
+        self.redraw_boxes([notebox])
+        
+    def select_range(self, notebox:'NoteBox'):
+        """Select the boxes shown between the selection anchor and notebox."""
+        end = self.get_list_index(notebox)
+        start = self.get_list_index(self.selection_anchor) \
+                if self.selection_anchor else None
+        if start is None:
+            start = end
+        start, end = min(start, end), max(start, end)
+        results = self.search_results
+        boxes = [box for box in self.box_list[start:end + 1]
+                 if results is None or box.get_name() in results]
+        self.selected.update(boxes)
+        self.selection_anchor = notebox
+        self.redraw_boxes(boxes)
+        
+    def clear_selection(self, event:tk.Tk=None):
+        """Unselect every notebox."""
+        boxes = list(self.selected)
+        self.selected.clear()
+        self.selection_anchor = None
+        self.redraw_boxes(boxes)
+        
+    def get_selected(self) -> List['NoteBox']:
+        """Return the selected noteboxes in the order of box_list."""
+        return [box for box in self.box_list if box in self.selected]
+        
+    def redraw_boxes(self, noteboxes:List['NoteBox']):
+        """Draw the noteboxes that have a label again, to show their selection."""
+        for notebox in noteboxes:
+            if notebox.label:
+                notebox.label.show(notebox, self.frame_width)
+        
+    def confirm_delete(self, notebox:'NoteBox'):
+        """Ask to delete the notebox, or the whole selection if it is in it."""
+        if notebox in self.selected and len(self.selected) > 1:
+            self.delete_selected()
+        elif messagebox.askyesno("Confirm...", "Delete note?"):
+            notebox.delete_note(from_button=True)
+        
+    def on_delete_key(self, event:tk.Tk):
+        """Delete the selected notes, unless text is being edited."""
+        if self.selected and self.winfo_ismapped() and \
+           not isinstance(self.focus_get(), (tk.Entry, tk.Text)):
+            self.delete_selected()
+        
+    def delete_selected(self):
+        """Ask to delete the selected notes, and delete them all at once."""
+        if messagebox.askyesno("Confirm...", "Delete {} notes?".format(
+                               len(self.selected))):
+            self.delete_boxes(self.get_selected())
+        
+    @core.trace.timed
+    def delete_boxes(self, noteboxes:List['NoteBox']):
+        """Delete the notes of several noteboxes and remove their boxes.
+        
+        Every note is deleted from disk and the indexes first, then the boxes
+        are removed together and the view is redrawn once.
+        """
+        for notebox in noteboxes:
+            core.Note.delete_note(notebox)
+        self.remove_boxes(noteboxes, from_button=True)
         
     def display_all(self):
-        """Place and show all frames onto the canvas and update the scrollregion."""
-        for index, frame in enumerate(self.frame_list):
-            frame.config(height=frame.height)
-            frame.tag = self.canvas.create_window(index*self.frame_width +
-                                                  index*gap, 0, window=frame,
-                                                  anchor='nw')
-            #  self.canvas.update()
-        self.canvas.config(scrollregion=self.canvas.bbox('all'))
+        """Update the scrollregion and show the noteboxes that are in view."""
+        width = self.num_frames*self.frame_width + (self.num_frames - 1)*gap
+        height = max(self.frame_heights, default=0)
+        self.canvas.config(scrollregion=(0, 0, width, height))
+        self.display_visible()
+        
+    @core.trace.timed
+    def display_visible(self):
+        """Give labels to the boxes near the viewport, take them from the rest.
+        
+        Boxes within one viewport's height above or below the visible area
+        are also shown so that short scrolls do not reveal empty space.
+        """
+        view_height = self.canvas.winfo_height()
+        top = self.canvas.canvasy(0) - view_height
+        bottom = top + 3*view_height
+        
+        visible = set()
+        for column, tops in zip(self.frame_list, self.frame_tops):
+            start = max(bisect.bisect_right(tops, top) - 1, 0)
+            end = bisect.bisect_left(tops, bottom)
+            visible.update(column[start:end])
+            
+        for notebox in self.shown_boxes - visible:
+            self.hide_box(notebox)
+        for notebox in visible - self.shown_boxes:
+            self.show_box(notebox)
+        
+    def show_box(self, notebox:'NoteBox'):
+        """Attach a label from the pool to the notebox and draw it."""
+        if self.label_pool:
+            label = self.label_pool.pop()
+        elif canvas_items:
+            label = NoteBoxItems(self.canvas, self.box_padding // 2)
+        else:
+            label = NoteBoxLabel(self.canvas)
+        label.show(notebox, self.frame_width)
+        self.shown_boxes.add(notebox)
+        
+    def hide_box(self, notebox:'NoteBox'):
+        """Detach the notebox's label, if any, and return it to the pool."""
+        if notebox.label:
+            self.label_pool.append(notebox.label)
+            notebox.label.hide()
+        self.shown_boxes.discard(notebox)
+        
+    def hide_all(self):
+        """Return every label to the pool."""
+        for notebox in list(self.shown_boxes):
+            self.hide_box(notebox)
         
     def resize_window(self, event:tk.Tk=None):
-        """Recalculate sizes and move objects to new spaces."""
+        """Schedule a resize for when the window stops changing size.
+        
+        <Configure> fires many times a second while the window is dragged,
+        so the events are coalesced and only the last one is acted on.
+        """
         try:
-            current_num_frames = self.num_frames
+            self.num_frames
         except:
             return
+            
+        if self.resize_after:
+            self.after_cancel(self.resize_after)
+        self.resize_after = self.after(resize_delay_ms, self.apply_resize)
         
+    @core.trace.timed
+    def apply_resize(self):
+        """Recalculate sizes and move objects to new spaces."""
+        self.resize_after = None
+        sizes = (self.num_frames, self.frame_width, self.max_width,
+                 self.max_lines)
         self.place_buttons()
         self.get_sizes()
-        if current_num_frames != self.num_frames:
-            self.refresh_frames()
-        self.resize_widgets()
         self.lift_buttons()
+        if sizes != (self.num_frames, self.frame_width, self.max_width,
+                     self.max_lines):
+            self.resize_widgets()
         
     def place_buttons(self):
         """Place 'new' and 'import' buttons on the bottom right corner."""
@@ -278,51 +648,262 @@ class ScrollableNoteBoxView(tk.Frame):
                                  anchor='se')
         self.new_button.place(x=new_button_x, y=new_button_y, anchor='se')
         
+    @core.trace.timed
     def refresh_frames(self):
-        """Update the positions of the frames and noteboxes."""
-        self.delete_frames()
-        self.create_frames()
-        self.reassign_boxes()
+        """Update the positions of the out-of-date noteboxes and redraw the view."""
+        if len(self.frame_list) != self.num_frames:
+            self.hide_all()
+            self.create_frames()
+        self.update_search()
+        start = self.layout_start
+        self.truncate_frames(start)
+        self.reassign_boxes(start)
+        self.layout_start = len(self.box_list)
         self.display_all()
         
-    def resize_widgets(self):
-        """Update the frame widths and rewrap the notebox texts accordingly."""
-        for index, frame in enumerate(self.frame_list):
-            frame.config(width=self.frame_width)
-            self.canvas.coords(frame.tag, index*self.frame_width + index*gap, 0)
-        for notebox in self.box_list:
+    def poll_watcher(self):
+        """Pick up the notes changed by other programs, then check again later."""
+        if not self.import_jobs and not self.load_job:
+            self.apply_changes(*self.watcher.poll())
+        self.after(watch_poll_ms, self.poll_watcher)
+        
+    @core.trace.timed
+    def apply_changes(self, changed:set, removed:set):
+        """Update the noteboxes of notes changed by other programs.
+        
+        Only the boxes of the given notes are touched, and the layout is
+        redone from the first of them onward. Changed boxes are updated
+        before any box is added or removed, while box_index is still valid.
+        """
+        added = []
+        for name in changed:
+            notebox = self.box_names.get(name)
+            if notebox is None:
+                added.append(name)
+                continue
+            notebox.read_preview(notebox.path)
             notebox.wrap_text(self.max_width, self.max_lines)
-            
+            index = self.get_list_index(notebox)
+            if index is not None:
+                self.invalidate_layout(index)
+        self.remove_boxes([self.box_names[name] for name in removed
+                           if name in self.box_names])
+        for name in added:
+            notebox = NoteBox(self, path=os.path.join(core.notes_dir, name),
+                              width=self.max_width, lines=self.max_lines)
+            self.insert_box(self.get_insert_index(name), notebox)
+        if changed or removed:
+            self.refresh_frames()
+        
+    def resize_widgets(self):
+        """Rewrap the notebox texts to the new sizes in the background."""
+        if self.rewrap_job:
+            self.rewrap_job.cancel()
+        self.rewrap_job = RewrapJob(self)
+        
+    @core.trace.timed
+    def finish_resize(self):
+        """Reposition all the noteboxes after they were rewrapped."""
+        self.rewrap_job = None
+        self.hide_all()
+        self.invalidate_layout()
+        self.refresh_frames()
+        
     def lift_buttons(self):
         """Raise the 'new' and 'import' buttons to the top visible layer."""
         self.new_button.lift()
         self.import_button.lift()
         
+    def show_progress(self, text:str):
+        """Show a progress message on the bottom left corner."""
+        self.progress_label.config(text=text)
+        self.progress_label.place(x=2, rely=1, y=-2, anchor='sw')
+        self.progress_label.lift()
+        
+    def hide_progress(self):
+        """Remove the progress message."""
+        self.progress_label.place_forget()
+        
+        
+class NoteBoxLabel(tk.Label):
+    """Pooled label that draws a notebox on the canvas.
+    
+    Labels are not tied to a note. ScrollableNoteBoxView hands a label to a
+    notebox when the notebox scrolls into view and takes it back when the
+    notebox scrolls out, so only a screenful or so of labels ever exists.
+    
+    Args:
+        canvas (obj): Canvas that the label is drawn on.
+        background (str, optional): Tkinter color (defined word, 6-digit hex,
+                                    etc.) for background.
+        
+    Attributes:
+        canvas (obj): Canvas that the label is drawn on.
+        tag (int): Id of the label's window item on the canvas.
+        notebox (obj): Notebox currently drawn by the label, or None.
+        
+    """
+    
+    def __init__(self, canvas:tk.Canvas, background:str=box_color):
+        """The constructor for NoteBoxLabel class."""
+        super().__init__(canvas, background=background, anchor='w',
+                         justify='left', font=font, wrap=None)
+        self.canvas = canvas
+        self.notebox = None
+        self.tag = canvas.create_window(0, 0, window=self, anchor='nw',
+                                        state='hidden')
+        core.trace.count('widgets_created')
+        self.bind('<Button-1>', self.on_click)
+        self.bind('<Control-Button-1>', self.on_select)
+        self.bind('<Shift-Button-1>', self.on_select_range)
+        self.bind('<Button-3>', self.on_click_delete)
+        
+    def on_click(self, event:tk.Tk):
+        """Open a new EditText view when a notebox is clicked."""
+        open_EditText(self.notebox)
+        
+    def on_select(self, event:tk.Tk):
+        """Select or unselect the clicked notebox."""
+        self.notebox.parent.toggle_selection(self.notebox)
+        
+    def on_select_range(self, event:tk.Tk):
+        """Select the noteboxes up to the clicked one."""
+        self.notebox.parent.select_range(self.notebox)
+        
+    def on_click_delete(self, event:tk.Tk):
+        """Open a confirmation dialog and delete (or not) the clicked notebox"""
+        self.notebox.parent.confirm_delete(self.notebox)
+        
+    def show(self, notebox:'NoteBox', width:int):
+        """Draw notebox's text at its position on the canvas."""
+        self.notebox = notebox
+        notebox.label = self
+        self.config(text=notebox.wrapped_text,
+                    background=selected_color
+                    if notebox in notebox.parent.selected else box_color)
+        self.canvas.coords(self.tag, notebox.x, notebox.y)
+        self.canvas.itemconfig(self.tag, width=width, state='normal')
+        
+    def move(self, x:int, y:int):
+        """Move the label to a new position on the canvas."""
+        self.canvas.coords(self.tag, x, y)
+        
+    def hide(self):
+        """Remove the label from the canvas and detach it from its notebox."""
+        self.canvas.itemconfig(self.tag, state='hidden')
+        if self.notebox:
+            self.notebox.label = None
+        self.notebox = None
+        
         
-class NoteBox(tk.Label):
-    """Individual box that displays the note's text.
+class NoteBoxItems:
+    """Pooled rectangle and text items that draw a notebox on the canvas.
+    
+    This is the renderer used instead of NoteBoxLabel when canvas_items is
+    set, and it is handed from notebox to notebox in the same way. A box is
+    drawn as two native canvas items rather than as a widget embedded in a
+    window item, so there is no widget to create or manage: showing, moving,
+    and hiding a box are a few canvas commands. Clicks are routed to the
+    notebox through the tag that the two items share.
+    
+    Args:
+        canvas (obj): Canvas that the items are drawn on.
+        padding (int): Space in pixels between the edge of the box and its
+                       text.
+        background (str, optional): Tkinter color (defined word, 6-digit hex,
+                                    etc.) for background.
+        
+    Attributes:
+        canvas (obj): Canvas that the items are drawn on.
+        padding (int): Space in pixels between the edge of the box and its
+                       text.
+        rect (int): Id of the box's rectangle item.
+        text (int): Id of the box's text item.
+        tag (str): Tag of both items.
+        width (int): Width of the box in pixels.
+        notebox (obj): Notebox currently drawn by the items, or None.
+        
+    """
+    
+    def __init__(self, canvas:tk.Canvas, padding:int,
+                 background:str=box_color):
+        """The constructor for NoteBoxItems class."""
+        self.canvas = canvas
+        self.padding = padding
+        self.notebox = None
+        self.width = 0
+        self.rect = canvas.create_rectangle(0, 0, 0, 0, fill=background,
+                                            width=0, state='hidden')
+        self.tag = 'notebox{}'.format(self.rect)
+        self.text = canvas.create_text(0, 0, anchor='nw', justify='left',
+                                       font=font, state='hidden',
+                                       tags=(self.tag,))
+        canvas.itemconfig(self.rect, tags=(self.tag,))
+        canvas.tag_bind(self.tag, '<Button-1>', self.on_click)
+        canvas.tag_bind(self.tag, '<Control-Button-1>', self.on_select)
+        canvas.tag_bind(self.tag, '<Shift-Button-1>', self.on_select_range)
+        canvas.tag_bind(self.tag, '<Button-3>', self.on_click_delete)
+        
+    def on_click(self, event:tk.Tk):
+        """Open a new EditText view when a notebox is clicked."""
+        open_EditText(self.notebox)
+        
+    def on_select(self, event:tk.Tk):
+        """Select or unselect the clicked notebox."""
+        self.notebox.parent.toggle_selection(self.notebox)
+        
+    def on_select_range(self, event:tk.Tk):
+        """Select the noteboxes up to the clicked one."""
+        self.notebox.parent.select_range(self.notebox)
+        
+    def on_click_delete(self, event:tk.Tk):
+        """Open a confirmation dialog and delete (or not) the clicked notebox"""
+        self.notebox.parent.confirm_delete(self.notebox)
+        
+    def show(self, notebox:'NoteBox', width:int):
+        """Draw notebox's text at its position on the canvas."""
+        self.notebox = notebox
+        notebox.label = self
+        self.width = width
+        self.canvas.itemconfig(self.text, text=notebox.wrapped_text)
+        self.canvas.itemconfig(self.rect, fill=selected_color
+                               if notebox in notebox.parent.selected
+                               else box_color)
+        self.move(notebox.x, notebox.y)
+        self.canvas.itemconfig(self.tag, state='normal')
+        
+    def move(self, x:int, y:int):
+        """Move the items to a new position on the canvas."""
+        self.canvas.coords(self.rect, x, y, x + self.width,
+                           y + self.notebox.height)
+        self.canvas.coords(self.text, x + self.padding, y + self.padding)
+        
+    def hide(self):
+        """Hide the items and detach them from their notebox."""
+        self.canvas.itemconfig(self.tag, state='hidden')
+        if self.notebox:
+            self.notebox.label = None
+        self.notebox = None
+        
+        
+class NoteBox(core.Note):
+    """Individual box that holds the note's text.
     
     The box's contents are read from a saved note file or imported via
-    the filedialog. There are three components to each note: title,
-    date created, and body text.
-    Title (optional): This is the first line of the saved note file. If there
-                      is no text, then the first line is blank.
-    Date: This comes from the filename of the saved note file. If a note is
-          imported from Google Keep, then it retains the original date. If a
-          note is changed, then it is given a new date and saved with that
-          new date. Modification date is more important than creation date.
-          This means that the most recently modified notes will always
-          appear first.
-    Body Text: The actual note. Lines are stored with newlines in the saved
-               file but are stripped of newlines when imported.
-    
-    There is always one box per note. Clicking on the box will open an EditText
-    window to edit the note's text. During a window resizing event, boxes are
-    not created or destroyed; their containing text is re-wrapped, and the
-    boxes are reassigned to the frames to ensure proper stacking.
+    the filedialog. The note itself, its title, date, and preview of the
+    body, is handled by core.Note; the box adds its wrapped text and
+    position. Like core.Note, it has slots, and it holds no more text than
+    it shows, so memory grows with the number of notes but not their length.
+    
+    There is always one box per note, but a box is not a widget. It is drawn
+    by a NoteBoxLabel only while it is in view. Clicking on the label will open
+    an EditText window to edit the note's text. During a window resizing
+    event, boxes are not created or destroyed; their containing text is
+    re-wrapped, and the boxes are reassigned to the columns to ensure proper
+    stacking.
     
     Args:
-        parent (obj): Tkinter object that will contain the class.
+        parent (obj): ScrollableNoteBoxView that will contain the box.
         path (str, optional): Absolute path to a note that the box will read in.
         width (int, optional): Maximum width in pixels of text that the box can
                                display. Usually comes from max_width in
@@ -330,148 +911,329 @@ class NoteBox(tk.Label):
         lines (int, optional): Maximum rows of text that the box can hold.
                                Usually comes from max_lines in
                                ScrollableNoteBoxView.
-        background (str, optional): Tkinter color (defined word, 6-digit hex,
-                                    etc.) for background.
-    
+        
     Attributes:
-        parent (obj): Tkinter object that contains the box.
-        path (str): Absolute path to the saved note's location on disk.
-        title (str): Title of the note.
-        text_lines (list): Lines of text as read from the note, stripped
-                           of newlines.
-        body_text (str): Full text of the note's body. Formed by joining
-                         text_lines together with newlines.
+        parent (obj): ScrollableNoteBoxView that contains the box.
         wrapped_text (str): Body text wrapped to correctly display in the box.
         height (int): Height of the box in pixels.
-    
+        x (int): Left position of the box on the canvas.
+        y (int): Top position of the box on the canvas.
+        label (obj): NoteBoxLabel or NoteBoxItems currently drawing the box,
+                     or None.
+        
     """
     
-    def __init__(self, parent:tk.Tk, path:str=None, width:int=0, lines:int=0,
-                 background:str=box_color):
+    __slots__ = ('parent', 'wrapped_text', 'height', 'x', 'y', 'label')
+    
+    def __init__(self, parent:ScrollableNoteBoxView, path:str=None,
+                 width:int=0, lines:int=0):
         """The constructor for NoteBox class."""
-        super().__init__(parent, background=background, anchor='w',
-                         justify='left', font=font, wrap=None)
+        super().__init__()
         self.parent = parent
-        self.path = path
-        self.bind('<Button-1>', self.on_click)
-        self.bind('<Button-3>', self.on_click_delete)
-        #  self.getFontSize()
+        self.label = None
+        self.x = 0
+        self.y = 0
         
-        self.title = ""
-        self.text_lines = []
-        self.body_text = ""
-        self.height = self.winfo_reqheight()
+        self.wrapped_text = ""
+        self.height = parent.get_box_height(0)
         
         if path:
-            self.read_note(path)
+            self.read_preview(path)
             self.wrap_text(width, lines)
         
-    def on_click(self, event:tk.Tk):
-        """Open a new EditText view when a notebox is clicked."""
-        open_EditText(event.widget)
-    
-    def on_click_delete(self, event:tk.Tk):
-        """Open a confirmation dialog and delete (or not) the clicked notebox"""
-        choice = messagebox.askyesno("Confirm...", "Delete note?")
-        if choice:
-            self.delete_note(from_button=True)
-            
-    def read_note(self, path:str):
-        """Set the notebox object's path, title, and body texts from the saved file."""
-        self.path = path
-        fp = open(path, 'r')
-        self.title = fp.readline()[:-1]
-        self.set_text(fp.readlines())
-        fp.close()
+    def wrap_text(self, width:int, max_lines:int):
+        """Wrap text within label according to max width and max line count.
         
-    def set_text(self, lines:List[str]):
-        """Format the text and set the notebox's text_lines and body_text."""
-        self.text_lines = [re.split('\n', line)[0] for line in lines]
-        self.body_text = '\n'.join(self.text_lines)
+        Only the lines that can be displayed are measured, so the cost does
+        not grow with the length of the note.
+        """
+        result = layout_cache.get(self.preview, width, max_lines)
+        if result is None:
+            shown_lines = itertools.islice((line for line
+                                            in self.get_preview_lines()
+                                            if non_blank_regex.search(line)),
+                                           int(max_lines))
+            text_layout.measure_missing(list(shown_lines))
+            result = self.get_wrapped_text(width, max_lines)
+        self.display_text(*result)
         
-    def wrap_text(self, width:int, max_lines:int):
-        """Wrap text within label according to max width and max line count."""
+    def get_wrapped_text(self, width:int, max_lines:int) -> tuple:
+        """Return the wrapped text and its number of lines.
+        
+        The result is taken from layout_cache if it is there, and added to
+        it if not. This does not touch Tk, so it can run on a background
+        thread as long as every character of the text is already in
+        text_layout's table.
+        """
+        result = layout_cache.get(self.preview, width, max_lines)
+        if result is None:
+            result = self.layout_text(width, max_lines)
+            layout_cache.put(self.preview, width, max_lines, result)
+        return result
+        
+    def layout_text(self, width:int, max_lines:int) -> tuple:
+        """Break the preview into lines, return the wrapped text and its number of lines."""
         wrap_count = 0
         wrap_list = []
-        non_blank_regex = re.compile('\S')
-        num_lines = len(self.text_lines)
-        for line in self.text_lines:
+        lines = self.get_preview_lines()
+        num_lines = len(lines)
+        for line in lines:
             while line and wrap_count < max_lines and \
                   non_blank_regex.search(line):
                 index = self.get_max_index(line, width)
                 if index != len(line) and wrap_count < max_lines - 1:
                     index = self.get_wrap_index(line, index)
                 wrap_list.append(line[:index])
-                line = line[index + 1:]
+                line = line[index:]
+                if line[:1] == ' ':
+                    line = line[1:]
                 wrap_count += 1
             if wrap_count == max_lines:
                 if non_blank_regex.search(line) or index < num_lines:
                     wrap_list[-1] = wrap_list[-1][:-2] + '\u2026'
                 break
-        self.wrapped_text = '\n'.join(wrap_list)
-        self.display_text(self.wrapped_text)
-            
+        return '\n'.join(wrap_list), len(wrap_list)
+        
     def get_max_index(self, line:str, width:int) -> int:
         """Calculate longest possible line according to maximum width of label."""
-        line_width = font.measure(line)
-        if line_width < width:
-            return len(line)
-        index = int(width * len(line) // line_width)
-        while font.measure(line[:index]) < width:
-            index += 1
-        while font.measure(line[:index]) > width:
-            index -= 1
-        return index
-    
+        return text_layout.get_max_index(line, width)
+        
     def get_wrap_index(self, line:str, index:int) -> int:
-        """Find most recent blank space to break line."""
-        # TODO handle word is too long to wrap, must truncate
-        start = index
-        while line[index] != ' ':
-            index -= 1
-            if index <= 0:
-                return start
-        return index
-        
-    def display_text(self, text:str):
-        """Change the notebox's displayed text."""
-        self.config(text=text)
-        self.height = self.winfo_reqheight()
-        
-    def get_new_date(self) -> str:
-        """Return the formatted date according to the current time and date."""
-        current_time = time.localtime()
-        return "{}-{:02}-{:02}T{:02}_{:02}_{:02}.note".\
-                format(*current_time[0:6])
-    
+        """Find most recent blank space to break line.
+        
+        If the word at index is too long to wrap, the word itself is broken
+        at index.
+        """
+        space = line.rfind(' ', 0, index + 1)
+        if space <= 0:
+            return index
+        return space
+        
+    def display_text(self, text:str, num_lines:int):
+        """Change the notebox's text and height, and its label if it has one."""
+        self.wrapped_text = text
+        self.height = self.parent.get_box_height(num_lines)
+        if self.label:
+            self.label.show(self, self.parent.frame_width)
+        
     def delete_note(self, from_button:bool=False):
         """Delete saved note file from disk and remove notebox from window."""
-        if self.path:
-            os.remove(self.path)
+        super().delete_note()
         self.parent.remove_box(self, from_button=from_button)
         
-    def save_note(self, filename:str):
-        """Save notebox contents to disk."""
-        self.path = os.path.join(notes_dir, filename)
-        fp = open(self.path, 'w+')
-        fp.write('\n'.join([self.title, self.body_text]))
-        fp.close()
+    def update_note(self, filename:str, body:str=None):
+        """Rename saved file to new date, move notebox to top of list, rewrap text.
         
-    def update_note(self, filename:str):
-        """Rename saved file to new date, move notebox to top of list, rewrap text."""
+        The body is read back from disk if it is not given, so that a note
+        whose title alone changed keeps its body.
+        """
+        if body is None:
+            body = self.read_body()
         self.delete_note()
-        self.save_note(filename)
+        self.save_note(filename, body)
         self.parent.insert_box(0, self)
         self.wrap_text(self.parent.max_width, self.parent.max_lines)
         
         
+class TextLayout:
+    """Line breaker that measures text with a cached table of glyph widths.
+    
+    Every font.measure call is a round trip to Tcl, and finding a line break
+    by measuring ever longer slices of a line costs several of them per line.
+    Instead, the advance width of each character is measured once and kept in
+    a table. The width of any prefix of a line is then a running sum of the
+    table's widths, and the longest prefix that fits is found with bisect.
+    
+    Args:
+        font (obj): Tkinter font that text is measured with.
+        
+    Attributes:
+        font (obj): Tkinter font that text is measured with.
+        font_key (tuple): Font attributes that the table was measured with.
+        widths (dict): Advance width in pixels of each measured character.
+        min_width (int): Narrowest non-zero width in the table.
+        
+    """
+    
+    def __init__(self, font:tkfont.Font):
+        """The constructor for TextLayout class."""
+        self.font = font
+        self.font_key = None
+        self.widths = {}
+        self.min_width = 1
+        
+    def check_font(self):
+        """Clear the width table if the font has changed since it was filled."""
+        font_key = tuple(sorted(self.font.actual().items()))
+        if font_key != self.font_key:
+            self.font_key = font_key
+            self.widths = {}
+            self.min_width = 1
+        
+    def measure_missing(self, lines:List[str]):
+        """Measure every character in lines that is not in the table yet."""
+        missing = set().union(*lines).difference(self.widths)
+        for char in missing:
+            self.widths[char] = self.font.measure(char)
+        core.trace.count('font_measures', len(missing))
+        widths = [width for width in self.widths.values() if width > 0]
+        if missing and widths:
+            self.min_width = min(widths)
+        
+    def get_max_index(self, line:str, width:int) -> int:
+        """Return the length of the longest prefix of line that fits in width.
+        
+        At least one character is always returned for a non-empty line, so
+        that a glyph wider than the box cannot stall the wrapping. All
+        characters of line must already be in the table.
+        """
+        limit = width // self.min_width + 1
+        offsets = list(itertools.accumulate(map(self.widths.__getitem__,
+                                                line[:limit])))
+        if len(line) <= limit and offsets[-1] <= width:
+            return len(line)
+        return max(bisect.bisect_right(offsets, width), 1)
+        
+        
+text_layout = None
+
+
+class LayoutCache:
+    """Persistent cache of wrapped note previews, by content and box size.
+    
+    Wrapping every note is most of the work of loading the view and of
+    resizing it, but the wrapped text of a note only depends on its preview,
+    the font, and the max_width and max_lines of the boxes, which rarely
+    change between sessions. The wrapped text and number of lines of each
+    preview, from which the box's height follows, are kept in a table per
+    font and size, keyed by a hash of the preview.
+    
+    Each table is saved in its own file in directory on exit, with only the
+    entries used during the session; a table none of whose entries were used
+    is left as it is. Only the layout_cache_sizes most recently used tables
+    are kept. Tables are read on the background
+    threads of LoadJob and RewrapJob, so the Tk thread never waits for the
+    disk; boxes wrapped before their table is read are wrapped as usual.
+    
+    Args:
+        directory (str): Absolute path to the directory of the table files.
+        
+    Attributes:
+        directory (str): Absolute path to the directory of the table files.
+        tables (dict): [wrapped text, number of lines] of each preview hash,
+                       in a dict for each table, keyed by the table's name.
+        used (dict): Preview hashes looked up or added in each table during
+                     the session, keyed by the table's name.
+        read (set): Names of the tables read from disk.
+        last (tuple): Font key, width, and max_lines of the last table used,
+                      and its name.
+        lock (obj): Lock for adding tables and entries from several threads.
+        
+    """
+    
+    version = 1
+    
+    def __init__(self, directory:str):
+        """The constructor for LayoutCache class."""
+        self.directory = directory
+        self.tables = {}
+        self.used = {}
+        self.read = set()
+        self.last = (None, None)
+        self.lock = threading.Lock()
+        
+    def get_name(self, width:int, max_lines:int) -> str:
+        """Return the name of the table for the current font and a box size."""
+        size = (text_layout.font_key, width, max_lines)
+        last_size, name = self.last
+        if size != last_size:
+            name = core.hash_text(repr((self.version,) + size))
+            self.last = (size, name)
+        return name
+        
+    def get(self, preview:str, width:int, max_lines:int) -> list:
+        """Return the cached wrapped text and number of lines of preview, or None."""
+        name = self.get_name(width, max_lines)
+        table = self.tables.get(name)
+        if not table:
+            return None
+        key = core.hash_text(preview)
+        result = table.get(key)
+        if result is not None:
+            with self.lock:
+                self.used.setdefault(name, set()).add(key)
+        return result
+        
+    def put(self, preview:str, width:int, max_lines:int, result:tuple):
+        """Add the wrapped text and number of lines of preview to the cache."""
+        name = self.get_name(width, max_lines)
+        key = core.hash_text(preview)
+        with self.lock:
+            self.tables.setdefault(name, {})[key] = list(result)
+            self.used.setdefault(name, set()).add(key)
+        
+    @core.trace.timed
+    def load(self, width:int, max_lines:int):
+        """Read the table for a box size from disk, if it was not read yet."""
+        name = self.get_name(width, max_lines)
+        if name in self.read:
+            return
+        self.read.add(name)
+        try:
+            fp = open(os.path.join(self.directory, name + '.json'), 'r')
+            table = json.load(fp)
+            fp.close()
+        except (OSError, ValueError):
+            return
+        with self.lock:
+            table.update(self.tables.get(name, {}))
+            self.tables[name] = table
+        
+    @core.trace.timed
+    def save(self):
+        """Write the tables used in the session, delete the least recently used.
+        
+        The tables are copied under the lock first, since LoadJob and
+        RewrapJob threads may still be adding to them.
+        """
+        with self.lock:
+            tables = {name: {key: self.tables[name][key] for key in keys}
+                      for name, keys in self.used.items() if keys}
+        if not tables:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for name, table in tables.items():
+            path = os.path.join(self.directory, name + '.json')
+            fp = open(path + '.tmp', 'w')
+            json.dump(table, fp, separators=(',', ':'))
+            fp.close()
+            os.replace(path + '.tmp', path)
+        paths = [os.path.join(self.directory, name)
+                 for name in os.listdir(self.directory)
+                 if name.endswith('.json')]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        for path in paths[layout_cache_sizes:]:
+            os.remove(path)
+        
+        
+layout_cache = LayoutCache(core.layout_dir)
+
+
 class EditText(tk.Frame):
     """Editor window to edit a note's title and body.
     
+    Changes to the body are detected with the text widget's modified flag,
+    which is cleared once the note is loaded, and a hash of the body as it
+    was loaded. Closing a note whose body was never touched does not copy
+    the body out of the widget at all.
+    
     Args:
         parent (obj): Tkinter object that will contain the class.
         notebox (int): Notebox that will be edited.
         
+    Attributes:
+        body_hash (str): Hash of the body as it was loaded.
+        
     """
     
     def __init__(self, parent:tk.Tk, notebox:tk.Tk):
@@ -488,13 +1250,14 @@ class EditText(tk.Frame):
                             font=font, undo=True)
         self.scrollbar = tk.Scrollbar(self, command=self.text.yview,
                                       background=box_color, width=3)
-        
+            
         if notebox is None:
             self.new = True
+            self.body_hash = core.hash_text("")
         else:
             self.new = False
             self.load_note(notebox)
-        
+            
         self.back.grid(row=0, column=0, sticky='ns')
         self.title.grid(row=0, column=1, columnspan=2, sticky='we')
         self.text.grid(row=1, column=0, columnspan=2, sticky='nesw')
@@ -502,50 +1265,442 @@ class EditText(tk.Frame):
         self.text.config(yscrollcommand=self.scrollbar.set)
         
         self.bind_keys()
+        core.trace.count('widgets_created', len(self.winfo_children()) + 1)
         
     def load_note(self, notebox:tk.Tk):
-        """Load the contents of the selected notebox."""
+        """Load the contents of the selected notebox.
+        
+        This is the only place the full body of a note is read from disk.
+        """
         self.notebox = notebox
+        body = self.notebox.read_body()
         self.title.insert('end', self.notebox.title)
-        self.text.insert('end', self.notebox.body_text)
+        self.text.insert('end', body)
+        self.text.edit_modified(False)
+        self.body_hash = core.hash_text(body)
         
     def bind_keys(self):
         """Bind the back button to close when clicked and the escape to close."""
         self.back.bind('<Button-1>', self.close_frame)
         self.bind_all('<Escape>', self.close_frame)
-            
+        
     def close_frame(self, event:tk.Tk):
         """Destroy the view from the window, show the main ScrollableNoteBoxView."""
         self.close_note()
         root.main_view.refresh_frames()
         root.main_view.pack(expand=True, fill='both')
         self.unbind_all('<Escape>')
+        core.trace.count('widgets_destroyed', len(self.winfo_children()) + 1)
         self.destroy()
         
+    @core.trace.timed
     def close_note(self):
         """If the note was changed, save the changes."""
         title = self.title.get()
-        body = self.text.get(1.0, 'end-1c')
-        if not title and not body:
+        if self.text.edit_modified():
+            body = self.text.get(1.0, 'end-1c')
+            body_changed = core.hash_text(body) != self.body_hash
+        else:
+            body = None
+            body_changed = False
+        if not title and not body and (self.new or body_changed):
             return
         if self.new:
             self.notebox = root.main_view.create_box(new=True)
-            self.notebox.title = ""
-            self.notebox.body_text = ""
-        if title != self.notebox.title or body != self.notebox.body_text:
-            filename = self.notebox.get_new_date()
+        if title != self.notebox.title or body_changed:
+            filename = core.get_new_date()
             
             self.notebox.title = title
-            self.notebox.body_text = body
-            self.notebox.text_lines = [line for line in body.split('\n')]
+            self.notebox.update_note(filename, body if body_changed else None)
+        
+        
+class RewrapJob:
+    """Rewrap of every notebox's text on a background thread.
+    
+    Line breaks for the new sizes are computed off the Tk thread, starting
+    with the boxes that are in view. When every box is done, the Tk main
+    loop applies the new texts and repositions the boxes in a single pass.
+    A job is cancelled when the window is resized again before it finishes.
+    
+    Args:
+        view (obj): ScrollableNoteBoxView whose noteboxes are rewrapped.
+        
+    Attributes:
+        view (obj): ScrollableNoteBoxView whose noteboxes are rewrapped.
+        width (int): Maximum width in pixels of the wrapped text.
+        max_lines (int): Maximum rows of the wrapped text.
+        boxes (list): Noteboxes to rewrap, visible ones first.
+        results (list): (text, num_lines) for each box, None for boxes that
+                        have characters missing from the width table, or
+                        None as a whole until the thread is done.
+        cancelled (bool): Whether the job was superseded.
+        thread (obj): Thread computing the line breaks.
+        
+    """
+    
+    def __init__(self, view:ScrollableNoteBoxView):
+        """The constructor for RewrapJob class."""
+        self.view = view
+        self.width = view.max_width
+        self.max_lines = view.max_lines
+        self.boxes = list(view.shown_boxes)
+        self.boxes.extend(box for box in view.box_list
+                          if box not in view.shown_boxes)
+        self.results = None
+        self.cancelled = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.view.after(rewrap_poll_ms, self.poll)
+        
+    @core.trace.timed
+    def run(self):
+        """Compute the wrapped text of every box."""
+        layout_cache.load(self.width, self.max_lines)
+        results = []
+        for box in self.boxes:
+            if self.cancelled:
+                return
+            try:
+                results.append(box.get_wrapped_text(self.width,
+                                                    self.max_lines))
+            except KeyError:
+                results.append(None)
+        self.results = results
+        
+    @core.trace.timed
+    def poll(self):
+        """Apply the results once the thread is done."""
+        if self.cancelled:
+            return
+        if self.results is None:
+            self.view.after(rewrap_poll_ms, self.poll)
+            return
+        for box, result in zip(self.boxes, self.results):
+            if result is None:
+                box.wrap_text(self.width, self.max_lines)
+            else:
+                box.display_text(*result)
+        self.view.finish_resize()
+        
+    def cancel(self):
+        """Stop the thread and drop the results."""
+        self.cancelled = True
+        
+        
+class LoadJob:
+    """Creation of the noteboxes of the notes below the first screenful.
+    
+    The noteboxes are created and wrapped on a background thread and handed
+    to the Tk main loop in batches of load_batch_size, one batch every
+    load_poll_ms. Each batch is added to the bottom of the columns and the
+    scroll region grows with it, so the window stays responsive while the
+    rest of the notes come in. Boxes with characters that are not in
+    text_layout's table yet, or that were wrapped for a size the window no
+    longer has, are wrapped again on the Tk thread. Notes that an import
+    has given a notebox in the meantime are left out.
+    
+    Once every box is in place, note_store is scanned and the notes that
+    changed since the note index was saved are applied to the view, and a
+    SearchJob loads the search index.
+    
+    Args:
+        view (obj): ScrollableNoteBoxView that the noteboxes are added to.
+        paths (list): Paths of the notes to create noteboxes for, in order.
+        
+    Attributes:
+        view (obj): ScrollableNoteBoxView that the noteboxes are added to.
+        paths (list): Paths of the notes to create noteboxes for, in order.
+        width (int): Maximum width in pixels of the wrapped text.
+        max_lines (int): Maximum rows of the wrapped text.
+        results (obj): Queue of batches of (notebox, wrapped text) pairs,
+                       ended by None. The wrapped text is None for boxes that
+                       must be wrapped on the Tk thread.
+        thread (obj): Thread creating the noteboxes.
+        
+    """
+    
+    def __init__(self, view:ScrollableNoteBoxView, paths:List[str]):
+        """The constructor for LoadJob class."""
+        self.view = view
+        self.paths = paths
+        self.width = view.max_width
+        self.max_lines = view.max_lines
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.view.after(load_poll_ms, self.poll)
+        
+    def run(self):
+        """Create and wrap the noteboxes, one batch at a time."""
+        layout_cache.load(self.width, self.max_lines)
+        batch = []
+        for path in self.paths:
+            notebox = NoteBox(self.view)
+            notebox.read_preview(path)
+            try:
+                wrapped = notebox.get_wrapped_text(self.width, self.max_lines)
+            except KeyError:
+                wrapped = None
+            batch.append((notebox, wrapped))
+            if len(batch) == load_batch_size:
+                self.results.put(batch)
+                batch = []
+        if batch:
+            self.results.put(batch)
+        self.results.put(None)
+        
+    @core.trace.timed
+    def poll(self):
+        """Add the next batch to the view, if it is ready."""
+        try:
+            batch = self.results.get_nowait()
+        except queue.Empty:
+            self.view.after(load_poll_ms, self.poll)
+            return
+        if batch is None:
+            self.finish()
+            return
             
-            self.notebox.update_note(filename)
+        sizes = (self.view.max_width, self.view.max_lines)
+        batch = [(notebox, wrapped) for notebox, wrapped in batch
+                 if notebox.get_name() not in self.view.box_names]
+        for notebox, wrapped in batch:
+            if wrapped is None or sizes != (self.width, self.max_lines):
+                notebox.wrap_text(*sizes)
+            else:
+                notebox.display_text(*wrapped)
+        self.view.insert_boxes(len(self.view.box_list),
+                               [notebox for notebox, wrapped in batch])
+        self.view.refresh_frames()
+        self.view.after(load_poll_ms, self.poll)
+        
+    def finish(self):
+        """Apply the changes made to the notes since the index was saved.
+        
+        This waits for imports to finish, since the notes they have saved
+        but not yet added to the view would be found as changes.
+        """
+        if self.view.import_jobs:
+            self.view.after(import_poll_ms, self.finish)
+            return
+        self.view.load_job = None
+        self.view.apply_changes(*core.note_index.refresh())
+        core.note_index.save()
+        if not core.search_index.loaded:
+            SearchJob(self.view)
+        
+        
+class SearchJob:
+    """Loading of the search index on a background thread.
+    
+    The search index file is read, and the notes that changed since it was
+    saved are read and indexed again, off the Tk thread. That is every note
+    when the file is missing or from an older version. Until the index is
+    taken over by the Tk main loop, a search query leaves the noteboxes
+    unfiltered, and the search is run once the index is ready.
+    
+    Args:
+        view (obj): ScrollableNoteBoxView that is searched.
+        
+    Attributes:
+        view (obj): ScrollableNoteBoxView that is searched.
+        stamps (dict): Stamp of every note when the job started, keyed by
+                       filename.
+        index (obj): core.SearchIndex built by the thread, or None until it
+                     is done.
+        thread (obj): Thread building the index.
+        
+    """
+    
+    def __init__(self, view:ScrollableNoteBoxView):
+        """The constructor for SearchJob class."""
+        self.view = view
+        self.stamps = core.note_index.get_stamps()
+        self.index = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.view.after(load_poll_ms, self.poll)
+        
+    def run(self):
+        """Build the search index."""
+        self.index = core.search_index.build(self.stamps)
+        
+    def poll(self):
+        """Take over the index once the thread is done, and search again."""
+        if self.thread.is_alive():
+            self.view.after(load_poll_ms, self.poll)
+            return
+        if core.search_index.loaded:
+            pass
+        elif self.index is None:
+            # the thread failed; load on this thread so that search works
+            core.search_index.load()
+        else:
+            core.search_index.adopt(self.index)
+        self.view.update_search()
+        self.view.refresh_frames()
+        
+        
+class ImportJob:
+    """Import of Takeout html files running in a pool of worker processes.
+    
+    The files are split into batches of import_batch_size. Each worker
+    parses its batch, extracts the title, date, and body of every note, and
+    saves the notes to disk. Finished batches are passed back through a
+    queue that the Tk main loop polls every import_poll_ms, so the window
+    stays responsive and the new noteboxes appear as their batches finish.
+    
+    Workers are started fresh rather than forked from the window's process,
+    so they do not inherit its Tk state or threads. They only need core,
+    which imports quickly and does not open a window.
+    
+    Workers are given the content hashes of the stored notes and skip the
+    notes that are already stored, so importing an updated Takeout export
+    again only writes what changed. A changed note that was imported before
+    replaces the note it was saved as, as recorded in core.import_index,
+    and its notebox is updated in place.
+    
+    Args:
+        view (obj): ScrollableNoteBoxView that the noteboxes are added to.
+        html_list (list): Paths of the html files or Takeout archives to
+                          import.
+        first_run (bool): Whether the notes keep their original dates.
+        
+    Attributes:
+        view (obj): ScrollableNoteBoxView that the noteboxes are added to.
+        total (int): Number of html files or archive members to import.
+        imported (int): Number of notes imported so far.
+        skipped (int): Number of notes found already stored so far.
+        failed (int): Number of files that could not be imported so far.
+        pending (int): Number of batches not received yet.
+        results (obj): Queue of finished batches with their sources.
+        pool (obj): Pool of worker processes.
+        
+    """
+    
+    def __init__(self, view:ScrollableNoteBoxView, html_list:List[str],
+                 first_run:bool=False):
+        """The constructor for ImportJob class."""
+        sources = core.get_import_sources(html_list)
+        batches = [sources[index:index + import_batch_size]
+                   for index in range(0, len(sources), import_batch_size)]
+        self.view = view
+        self.total = len(sources)
+        self.imported = 0
+        self.skipped = 0
+        self.failed = 0
+        self.pending = len(batches)
+        self.results = queue.Queue()
+        core.import_index.load()
+        
+        self.pool = multiprocessing.get_context('spawn').Pool(
+                    initializer=core.init_worker,
+                    initargs=(core.trace.path, core.trace.start_time,
+                              core.note_index.get_hashes(),
+                              core.import_index.names))
+        for batch in batches:
+            self.pool.apply_async(core.import_batch, (batch, first_run),
+                                  callback=functools.partial(
+                                  self.on_batch, batch),
+                                  error_callback=functools.partial(
+                                  self.on_batch_error, batch))
+        self.pool.close()
+        self.view.import_jobs += 1
+        
+        self.view.show_progress("Importing 0/{}".format(self.total))
+        self.view.after(import_poll_ms, self.poll)
+        
+    def on_batch(self, batch:List[tuple], result:tuple):
+        """Queue the results of a finished batch for the next poll."""
+        self.results.put((batch,) + result)
+        
+    def on_batch_error(self, batch:List[tuple], error:Exception):
+        """Count every file of a batch whose worker failed as not imported."""
+        self.results.put((batch, [None] * len(batch), ([], {})))
+        
+    @core.trace.timed
+    def poll(self):
+        """Add the batches that finished since the last poll to the view."""
+        new_boxes = []
+        updated = False
+        core.note_store.refresh()
+        while True:
+            try:
+                batch, results, recorded = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.pending -= 1
+            core.trace.merge(*recorded)
+            for (archive, name), result in zip(batch, results):
+                if result is None:
+                    self.failed += 1
+                elif result is False:
+                    self.skipped += 1
+                else:
+                    self.imported += 1
+                    core.import_index.add(name, result[0])
+                    notebox = self.create_box(*result)
+                    if notebox:
+                        new_boxes.append(notebox)
+                    else:
+                        updated = True
+            
+        if new_boxes:
+            self.view.insert_boxes(0, new_boxes)
+        if new_boxes or updated:
+            self.view.refresh_frames()
+            
+        if self.pending:
+            self.view.show_progress("Importing {}/{}".format(
+                                    self.imported + self.skipped + self.failed,
+                                    self.total))
+            self.view.after(import_poll_ms, self.poll)
+        else:
+            self.finish()
+        
+    def create_box(self, path:str, title:str, body:str,
+                   stamp:list) -> 'NoteBox':
+        """Create a notebox for a note that a worker saved to disk.
+        
+        If the view already has a notebox for the note, that notebox is
+        updated instead and None is returned.
+        """
+        core.index_note(path, title, body, stamp)
+        notebox = self.view.box_names.get(os.path.basename(path))
+        if notebox:
+            notebox.title = title
+            notebox.set_body(body)
+            notebox.wrap_text(self.view.max_width, self.view.max_lines)
+            index = self.view.get_list_index(notebox)
+            if index is not None:
+                self.view.invalidate_layout(index)
+            return None
+        notebox = NoteBox(self.view)
+        notebox.path = path
+        notebox.title = title
+        notebox.set_body(body)
+        notebox.wrap_text(self.view.max_width, self.view.max_lines)
+        return notebox
+        
+    def finish(self):
+        """Shut down the workers and save the note index."""
+        self.pool.join()
+        self.view.import_jobs -= 1
+        core.note_index.save()
+        core.search_index.save()
+        core.import_index.save()
+        message = "Imported {}".format(self.imported)
+        if self.skipped:
+            message += ", {} unchanged".format(self.skipped)
+        if self.failed:
+            message += ", {} failed".format(self.failed)
+        if self.skipped or self.failed:
+            self.view.show_progress(message)
+            self.view.after(5000, self.view.hide_progress)
+        else:
+            self.view.hide_progress()
         
         
-def get_notes() -> List[str]:
-    """Return a list of all notes, sorted by most recent first."""
-    return sorted(glob.glob(os.path.join(notes_dir, '*.note')), reverse=True)
-
 def open_EditText(notebox:tk.Tk=None):
     """Create an EditText view and hide the main ScrollableNoteBoxView."""
     root.main_view.pack_forget()
@@ -555,128 +1710,111 @@ def open_import_dialog(window:tk.Tk, first_run:bool=False):
     """Create and display a tkinter filedialog, import selected notes."""
     notes = filedialog.askopenfilenames(initialdir=os.path.expanduser\
                                         ('~/Downloads/Takeout/Keep'),
-                                        filetypes=(("HTML files", '*.html'),
+                                        filetypes=(("Takeout notes",
+                                                    ('*.html', '*.json',
+                                                     '*.zip')),
                                         ("All files", '*.*')),
                                         title="Choose note(s) to import")
     if notes:
-        import_notes(notes, first_run)
         if first_run:
             root.main_view.pack(expand=True, fill='both')
-            root.main_view.init()
+            if root.main_view.watcher is None:
+                root.main_view.init()
             window.destroy()
-
-def check_for_directory():
-    """If note folder does not exist, create it with 700 permission."""
-    if not os.path.isdir(notes_dir):
-        os.mkdir(notes_dir, mode=0o700)
-
-def import_notes(html_list:List[str], first_run:bool=False):
-    """Import all html files in html_list, save to disk, and create noteboxes."""
+        import_notes(notes, first_run)
+        
+def import_notes(html_list:List[str], first_run:bool=False) -> ImportJob:
+    """Import all html files in html_list in the background, add noteboxes as they finish."""
     root.main_view.get_sizes()
-    new_boxes = []
-    for html_file in html_list:
-        if html_file[-4:] != 'html':
-            continue
-        
-        fp = open(html_file)
-        soup = bs4.BeautifulSoup(fp, 'html.parser')
-        
-        notebox = NoteBox(root.main_view, width=root.main_view.max_width,
-                          lines=root.main_view.max_lines)
-        new_boxes.append(notebox)
-        
-        notebox.title = get_title(soup)
-        filename = get_filename(soup, html_file, notebox, first_run)
-        
-        text = str(soup.find_all('div', class_='content')[0])
-        lines = text[21:-6].split('<br/>')
-        notebox.set_text(lines)
-        notebox.wrap_text(root.main_view.max_width, root.main_view.max_lines)
-        
-        notebox.save_note(filename)
-    root.main_view.box_list = new_boxes + root.main_view.box_list
-    root.main_view.refresh_frames()
-                
-def get_title(soup:bs4.BeautifulSoup) -> str:
-    """Return the title of the note, or an empty string if none."""
-    pattern = re.compile('[JFMASOND][aepuco][nbrylgptvc] \d\d?, \d\d\d\d, \d[012]?:\d\d:\d\d [AP]M')
-    soup_string = soup.title.string
-    if not pattern.match(soup_string):
-        # note has a title
-        return soup_string
-    else:
-        # note does not have a title
-        return ""
-    
-def get_filename(soup:bs4.BeautifulSoup, path:str, notebox:tk.Tk, first_run:bool) -> str:
-    """Return the new filename for the note, which is equal to its creation date."""
-    pattern = re.compile('[JFMASOND][aepuco][nbrylgptvc] \d\d?, \d\d\d\d, \d[012]?:\d\d:\d\d [AP]M')
-    if not pattern.match(soup.title.string) and first_run:
-        heading = str(soup.find_all('div', class_='heading')[0])
-        return process_date(pattern.search(heading).group())
-    elif first_run:
-        return os.path.basename(path)[:-15] + '.note'
-    else:
-        return notebox.get_new_date()
-        
-def process_date(date:str) -> str:
-    """Convert a date string into a date/filename string, return it."""
-    months = {'Jan': '01', 'Feb': '02', 'Mar': '03', 'Apr': '04',
-              'May': '05', 'Jun': '06', 'Jul': '07', 'Aug': '08',
-              'Sep': '09', 'Oct': '10', 'Nov': '11', 'Dec': '12'}
-    
-    year = re.search('\d\d\d\d', date).group()
-    month = months[date[0:3]]
-    day = int(re.search('\d\d?(?=,)', date).group())
-    hour = int(re.search('(?<= )\d\d?(?=:)', date).group())
-    minute = int(re.search('(?<=:)\d\d(?=:)', date).group())
-    second = int(re.search('(?<=:)\d\d(?= )', date).group())
-    
-    daytime_bool = re.search('AM', date)
-    if not daytime_bool:
-        hour = hour + 12
-    
-    return "{}-{}-{:02}T{:02}_{:02}_{:02}.note".format(year,
-                                                       month,
-                                                       day,
-                                                       hour,
-                                                       minute,
-                                                       second)
+    return ImportJob(root.main_view, html_list, first_run)
     
 def save_window_dimensions():
     """Write the formatted window dimensions to disk."""
-    path = os.path.join(main_dir, 'win_size')
+    path = os.path.join(core.main_dir, 'win_size')
     fp = open(path, 'w+')
     fp.write("{}x{}".format(root.winfo_width(), root.winfo_height()))
     fp.close()
     
 def read_window_dimensions():
     """Load previous session's window dimensions from disk and resize root window."""
-    path = os.path.join(main_dir, 'win_size')
+    path = os.path.join(core.main_dir, 'win_size')
     if os.path.exists(path):
         fp = open(path, 'r')
         dimensions = fp.readline()
         fp.close()
         
         root.geometry(dimensions)
-    
+        
 def on_close():
-    """Save window dimensions, destroy root window, close program."""
+    """Save window dimensions, queued notes, and indexes, destroy root window, close program.
+    
+    If queued notes cannot be written, the window stays open unless the user
+    chooses to quit without them.
+    """
     save_window_dimensions()
+    try:
+        core.save_queue.drain()
+    except OSError as error:
+        if not messagebox.askyesno("Notes not saved",
+                                   "Some notes could not be saved: {}\n\n"
+                                   "Quit anyway and lose the changes?".format(
+                                   error.strerror or error)):
+            return
+    core.note_store.close()
+    core.note_index.save()
+    core.search_index.save()
+    core.import_index.save()
+    layout_cache.save()
+    core.trace.save()
     root.destroy()
     
+def toggle_trace_summary(event:tk.Tk=None):
+    """Show or hide the summary of the last frame's costs."""
+    if core.trace.summary:
+        core.trace.summary.destroy()
+        core.trace.summary = None
+    else:
+        core.trace.summary = tk.Label(root, text=core.trace.last_frame,
+                                      justify='left', background=box_color)
+        core.trace.summary.place(x=gap, rely=1.0, y=-gap, anchor='sw')
+        
+def create_window():
+    """Create the root window and the font and text layout of the noteboxes."""
+    global root, font, text_layout
+    root = tk.Tk()
+    root.title("Keeper")
+    font = tkfont.Font()
+    text_layout = TextLayout(font)
+    core.trace.after_idle = root.after_idle
+    
 def main():
     """Main function."""
+    global canvas_items
+    canvas_items = '--canvas-items' in sys.argv[1:]
+    create_window()
     read_window_dimensions()
     root.protocol("WM_DELETE_WINDOW", on_close)
+    if '--trace' in sys.argv[1:]:
+        core.trace.start(core.trace_path)
+    if core.trace.enabled:
+        root.bind_all('<F12>', toggle_trace_summary)
     root.main_view = ScrollableNoteBoxView(root)
-    if not get_notes():
-        check_for_directory()
+    if '--log-store' in sys.argv[1:]:
+        core.migrate_notes()
+    core.note_index.load()
+    if not core.note_index.entries:
+        core.note_index.refresh()
+    if not core.get_notes():
+        core.check_for_directory()
         root.main_view.pack_forget()
         FirstRunView(root)
     else:
         root.main_view.init()
     root.mainloop()
-
+    
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    if sys.argv[1:2] and sys.argv[1] in cli.commands:
+        sys.exit(cli.main())
     main()
+    
\ No newline at end of file